@@ -84,6 +84,11 @@ class Settings(BaseSettings):
         return f"https://guiltless-inadequately-wilda.ngrok-free.dev{self.zoom_redirect_path}"
     
     
+    # upcoming types must come before previous_meetings
+    zoom_sync_meeting_types: list[str] = ["upcoming", "scheduled", "previous_meetings"]
+    zoom_sync_window_days: int = 30
+    
+    
     trello_api_key: str 
     trello_client_secret: str
     trello_app_name: str 
@@ -92,6 +97,61 @@ class Settings(BaseSettings):
     def trello_redirect_uri(self):
         # return f"{self.backend_base_url}{self.trello_redirect_path}"
         return f"https://guiltless-inadequately-wilda.ngrok-free.dev{self.trello_redirect_path}"
+    
+    
+    http_connect_timeout_seconds: float = 5
+    http_read_timeout_seconds: float = 30
+    http_pool_hosts: int = 16
+    http_pool_maxsize: int = 32
+    http_async_workers: int = 32
+    
+    provider_max_retries: int = 5
+    provider_retry_budget: int = 20
+    provider_backoff_base_seconds: float = 0.5
+    provider_backoff_cap_seconds: float = 30
+    provider_max_retry_after_seconds: float = 60
+    provider_bucket_cache_size: int = 10000
+    
+    token_refresh_margin_seconds: int = 300
+    credential_cache_size: int = 10000
+    # unset: two sync intervals plus jitter, so an entry outlives the gap between two scheduled syncs of an integration
+    credential_cache_ttl_seconds: int | None = None
+    
+    sync_max_concurrent_providers: int = 4
+    classroom_sync_max_concurrency: int = 8
+    
+    # background sync of every connected integration (instances claim due integrations, so it can run on all of them)
+    sync_scheduler_enabled: bool = True
+    sync_scheduler_tick_seconds: int = 60
+    sync_interval_minutes: int = 15
+    sync_jitter_seconds: int = 120
+    sync_worker_pool_size: int = 8
+    sync_provider_concurrency: dict[str, int] = {"google_tasks": 4, "google_classroom": 2, "trello_cards": 4, "zoom_meetings": 4}
+    
+    # change feed cursors older than this get 410 Gone, the client reloads its task list
+    task_tombstone_retention_days: int = 30
+    task_tombstone_sweep_seconds: int = 3600
+    
+    # "local" fans task events out inside one worker, "postgres" goes through LISTEN/NOTIFY for several workers
+    task_events_backend: str = "local"
+    task_events_heartbeat_seconds: int = 15
+    
+    task_stats_cache_size: int = 10000
+    task_stats_cache_ttl_seconds: int = 60     # bounds how stale the time-dependent overdue count can get
+    
+    # authenticated user principals; invalidation is per process, the TTL bounds staleness on other workers
+    principal_cache_size: int = 10000
+    principal_cache_ttl_seconds: int = 60
+    
+    # bcrypt cost; stored hashes with a lower cost are rehashed on the next successful login
+    password_hash_rounds: int = 12
+    password_hash_workers: int = os.cpu_count() or 2
+    
+    # a token presented again this soon after its rotation (two tabs, a client retry) is rejected without revoking its family
+    refresh_token_reuse_grace_seconds: int = 10
+    refresh_token_sweep_seconds: int = 3600
+    refresh_token_sweep_batch_size: int = 5000
+    token_revocation_refresh_seconds: int = 5
 
 
     class Config:
@@ -4,17 +4,20 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
-from app import models
+from app import models, oauth2
 from app.database import engine 
+from app.migrations import run_migrations
 
 from app.routers import user, task
 from app.routers.auth import app_auth, google_auth, apple_auth, facebook_auth
 from app.routers.uploads import upload_files
 from app.routers.integrations import sync_task, google_tasks, google_classroom, trello_cards, zoom_meetings
+from app.utils import crypt_utils, http_client
 # from archieve.tester import tester
 
 # creating database if not exists
 models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
 app = FastAPI()
 
@@ -26,6 +29,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 
 
 )
@@ -48,6 +52,16 @@ app.include_router(zoom_meetings.router)
 app.include_router(upload_files.router)
 
 
+@app.get("/api/health")
+def health():
+    return {
+        "status": "ok",
+        "http_pools": http_client.pool_stats(),
+        "principal_cache": dict(oauth2.principal_cache_stats),
+        "credential_cache": dict(crypt_utils.credential_cache_stats),
+    }
+
+
 
 
 
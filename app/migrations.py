@@ -0,0 +1,151 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.models import TASK_SEARCH_VECTOR, TASK_ENUM_COLUMNS
+
+
+# `create_all` only creates missing tables, so columns and indexes added to existing tables are applied here.
+# every statement must be idempotent as they all run on each startup.
+MIGRATIONS = [
+    # incremental sync cursors
+    "ALTER TABLE integrations ADD COLUMN IF NOT EXISTS sync_cursor VARCHAR",
+    "ALTER TABLE integrations ADD COLUMN IF NOT EXISTS last_synced_at TIMESTAMP WITHOUT TIME ZONE",
+    
+    # background sync scheduling
+    "ALTER TABLE integrations ADD COLUMN IF NOT EXISTS next_sync_at TIMESTAMP WITHOUT TIME ZONE",
+    
+    # access token invalidation epoch
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS tokens_invalid_before TIMESTAMP WITH TIME ZONE",
+    
+    # per-user task version (ETags)
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS tasks_version BIGINT NOT NULL DEFAULT 0",
+    
+    # task list keyset pagination
+    "CREATE INDEX IF NOT EXISTS ix_tasks_user_deadline_id ON tasks (user_id, deadline, id)",
+    "CREATE INDEX IF NOT EXISTS ix_tasks_user_status_deadline_id ON tasks (user_id, status, deadline, id)",
+    "CREATE INDEX IF NOT EXISTS ix_tasks_user_source_deadline_id ON tasks (user_id, source, deadline, id)",
+    
+    # task change feed
+    "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT 0",
+    "CREATE INDEX IF NOT EXISTS ix_tasks_user_change_seq_id ON tasks (user_id, change_seq, id)",
+]
+
+
+def _enum_column_migrations(column: str, enum_class, type_name: str, fallback) -> list[str]:
+    labels = ", ".join(f"'{member.value}'" for member in enum_class)
+    return [
+        f"""DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = '{type_name}') THEN
+                CREATE TYPE {type_name} AS ENUM ({labels});
+            END IF;
+        END $$""",
+        # new enum members are appended to an existing type
+        *(f"ALTER TYPE {type_name} ADD VALUE IF NOT EXISTS '{member.value}'" for member in enum_class),
+    ]
+
+
+def _enum_column_conversion(column: str, enum_class, type_name: str, fallback) -> tuple[str, str, list[str], bool]:
+    labels = ", ".join(f"'{member.value}'" for member in enum_class)
+    return (
+        f"tasks.{column} as {type_name}",
+        f"SELECT data_type = 'character varying' FROM information_schema.columns WHERE table_name = 'tasks' AND column_name = '{column}'",
+        [
+            # free-form text of existing rows: fix the case of known values, anything else becomes the fallback
+            f"""UPDATE tasks SET {column} = label FROM unnest(ARRAY[{labels}]) AS label
+                WHERE lower(tasks.{column}) = lower(label) AND tasks.{column} <> label""",
+            f"UPDATE tasks SET {column} = '{fallback.value}' WHERE {column} NOT IN ({labels})",
+            f"ALTER TABLE tasks ALTER COLUMN {column} TYPE {type_name} USING {column}::{type_name}",
+        ],
+        True,
+    )
+
+
+# migrations that rewrite or lock a big table for long (ACCESS EXCLUSIVE on `tasks`) never run at startup,
+# apply them once before deploying the code that needs them with
+#     python -m app.migrations
+# (name, query returning whether it is still pending, statements, run in one transaction)
+ONE_OFF_MIGRATIONS: list[tuple[str, str, list[str], bool]] = []
+
+# task status, priority, category and source as Postgres enums
+for _column in TASK_ENUM_COLUMNS:
+    MIGRATIONS += _enum_column_migrations(*_column)
+    ONE_OFF_MIGRATIONS.append(_enum_column_conversion(*_column))
+
+ONE_OFF_MIGRATIONS += [
+    # task full-text search: the generated column rewrites the table once
+    (
+        "tasks.search_vector",
+        "SELECT NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'tasks' AND column_name = 'search_vector')",
+        [f"ALTER TABLE tasks ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({TASK_SEARCH_VECTOR}) STORED"],
+        True,
+    ),
+    # built without blocking writes; a build that failed half way leaves an invalid index, dropped and built again
+    (
+        "ix_tasks_user_search_vector",
+        "SELECT NOT EXISTS (SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid WHERE relname = 'ix_tasks_user_search_vector' AND indisvalid)",
+        [
+            "CREATE EXTENSION IF NOT EXISTS btree_gin",
+            "DROP INDEX CONCURRENTLY IF EXISTS ix_tasks_user_search_vector",
+            "CREATE INDEX CONCURRENTLY ix_tasks_user_search_vector ON tasks USING GIN (user_id, search_vector)",
+            "DROP INDEX CONCURRENTLY IF EXISTS ix_tasks_search_vector",
+        ],
+        False,
+    ),
+    # provider task ids unique per user instead of globally, the conflict target of the sync upserts
+    (
+        "uq_tasks_user_provider_task_id",
+        "SELECT NOT EXISTS (SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid WHERE relname = 'uq_tasks_user_provider_task_id' AND indisvalid)",
+        [
+            "DROP INDEX CONCURRENTLY IF EXISTS uq_tasks_user_provider_task_id",
+            "CREATE UNIQUE INDEX CONCURRENTLY uq_tasks_user_provider_task_id ON tasks (user_id, integration_provider_task_id)",
+            "ALTER TABLE tasks DROP CONSTRAINT IF EXISTS tasks_integration_provider_task_id_key",
+        ],
+        False,
+    ),
+]
+
+
+# every worker runs the startup migrations: they wait for each other instead of racing on the same DDL
+MIGRATIONS_LOCK_ID = 7_210_431
+ONE_OFF_MIGRATIONS_LOCK_ID = 7_210_432
+
+
+def run_migrations(engine: Engine):
+    with engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": MIGRATIONS_LOCK_ID})
+        for statement in MIGRATIONS:
+            connection.execute(text(statement))
+
+        for name, pending, *_ in ONE_OFF_MIGRATIONS:
+            if connection.execute(text(pending)).scalar():
+                print(f"Pending one-off migration: {name}, run `python -m app.migrations`")
+
+
+def run_one_off_migrations(engine: Engine):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        # session lock held across the steps: two deploys never apply the same step at once. Not the startup lock,
+        # CREATE INDEX CONCURRENTLY waits for open transactions, such as a starting worker waiting on that lock
+        connection.execute(text("SELECT pg_advisory_lock(:lock_id)"), {"lock_id": ONE_OFF_MIGRATIONS_LOCK_ID})
+        try:
+            for name, pending, statements, transactional in ONE_OFF_MIGRATIONS:
+                if not connection.execute(text(pending)).scalar():
+                    continue
+
+                print(f"Applying one-off migration: {name}")
+                if transactional:
+                    with engine.begin() as transaction:
+                        for statement in statements:
+                            transaction.execute(text(statement))
+                else:
+                    # CREATE INDEX CONCURRENTLY and the like can't run inside a transaction block
+                    for statement in statements:
+                        connection.execute(text(statement))
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": ONE_OFF_MIGRATIONS_LOCK_ID})
+
+
+if __name__ == "__main__":
+    from app.database import engine
+
+    run_migrations(engine)
+    run_one_off_migrations(engine)
@@ -1,7 +1,9 @@
-from sqlalchemy import Column, Integer, String, TIMESTAMP, ForeignKey, DateTime, Boolean, Date
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, TIMESTAMP, ForeignKey, DateTime, Boolean, Date, Index, Computed, Enum, DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql.expression import text 
 from datetime import datetime
+import enum
 
 from app.database import Base 
 
@@ -18,9 +20,41 @@ class User(Base):
     created_at              = Column(TIMESTAMP(timezone=True),  nullable=False, server_default=text('now()'))
     
     # App verfications
-    refresh_token           = Column(String,                    nullable=True )
-    refresh_token_expiry    = Column(DateTime,                  nullable=True ) 
+    refresh_token           = Column(String,                    nullable=True ) # unused, refresh tokens live in `refresh_tokens`
+    refresh_token_expiry    = Column(DateTime,                  nullable=True ) # unused
     is_verified             = Column(Boolean,                   nullable=False, default=text('false')) 
+    tokens_invalid_before   = Column(TIMESTAMP(timezone=True),  nullable=True ) # access tokens issued earlier are rejected (logout, password reset)
+    
+    # bumped by every write of the user's tasks (task router and provider syncs), drives the task list ETags
+    tasks_version           = Column(BigInteger,                nullable=False, server_default=text('0'))
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    
+    # one row per issued refresh token; every rotation of a login (device) shares its family
+    id              = Column(Integer,                                               primary_key=True)
+    jti             = Column(String,                                                nullable=False, unique=True)
+    user_id         = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"),   nullable=False, index=True)
+    family_id       = Column(String,                                                nullable=False, index=True)
+    token_digest    = Column(String,                                                nullable=False) # HMAC-SHA256 of the token, never the token itself
+    issued_at       = Column(TIMESTAMP(timezone=True),                              nullable=False, server_default=text("now()"))
+    expires_at      = Column(TIMESTAMP(timezone=True),                              nullable=False, index=True)
+    used_at         = Column(TIMESTAMP(timezone=True),                              nullable=True ) # rotated: presenting it again is a reuse
+    revoked_at      = Column(TIMESTAMP(timezone=True),                              nullable=True )
+
+
+class TokenRevocation(Base):
+    __tablename__ = "token_revocations"
+    
+    # a revoked access token (jti) or a "tokens issued before not_before are invalid" user epoch;
+    # loaded into every worker's memory, dropped once no token it covers can still be unexpired
+    id              = Column(Integer,                                               primary_key=True)
+    jti             = Column(String,                                                nullable=True, unique=True)
+    user_id         = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"),   nullable=False)
+    not_before      = Column(TIMESTAMP(timezone=True),                              nullable=True)
+    expires_at      = Column(TIMESTAMP(timezone=True),                              nullable=False, index=True)
+    created_at      = Column(TIMESTAMP(timezone=True),                              nullable=False, server_default=text("now()"), index=True)
 
 
 class AuthProvider(Base):
@@ -44,31 +78,134 @@ class Integration(Base):
     access_token    = Column(String)
     refresh_token   = Column(String)
     expiry          = Column(DateTime)
+    
+    # incremental sync: provider changes are only fetched after this cursor (RFC 3339 time of the last successful sync)
+    sync_cursor     = Column(String,    nullable=True)
+    last_synced_at  = Column(DateTime,  nullable=True)
+    # background scheduler: not synced again before this time (claimed, backing off after a failure, or jittered)
+    next_sync_at    = Column(DateTime,  nullable=True)
 
     owner = relationship("User")
 
 
+# stored as Postgres enums (4 bytes per value), the API reads and writes the values
+class TaskStatus(str, enum.Enum):
+    IN_PROGRESS = "In progress"
+    COMPLETED   = "Completed"
+    FAILED      = "Failed"
+    OVERDUE     = "Overdue"     # Trello cards past due
+    UPCOMING    = "Upcoming"    # Zoom meetings
+
+
+class TaskPriority(str, enum.Enum):
+    LOW     = "Low"
+    MEDIUM  = "Medium"
+    HIGH    = "High"
+
+
+class TaskCategory(str, enum.Enum):
+    DEVELOPMENT = "Development"
+    STUDY       = "Study"
+    MEETING     = "Meeting"
+    ASSIGNMENT  = "Assignment"
+    WORK        = "Work"
+    RESEARCH    = "Research"
+    PERSONAL    = "Personal"
+    GENERAL     = "General"
+    # provider imports
+    CLASSROOM   = "Classroom"
+    TRELLO      = "Trello"
+    ZOOM        = "Zoom"
+
+
+class TaskSource(str, enum.Enum):
+    SENTRY              = "sentry"
+    GOOGLE_TASKS        = "Google Tasks"
+    GOOGLE_CLASSROOM    = "Google Classroom"
+    TRELLO              = "Trello"
+    ZOOM                = "Zoom"
+
+
+# (column, enum, Postgres type, value existing rows outside the enum are migrated to)
+TASK_ENUM_COLUMNS = (
+    ("status",   TaskStatus,   "task_status",   TaskStatus.IN_PROGRESS),
+    ("priority", TaskPriority, "task_priority", TaskPriority.MEDIUM),
+    ("category", TaskCategory, "task_category", TaskCategory.GENERAL),
+    ("source",   TaskSource,   "task_source",   TaskSource.SENTRY),
+)
+
+
+def enum_column(enum_class, name):
+    return Enum(enum_class, name=name, values_callable=lambda members: [member.value for member in members], validate_strings=True)
+
+
+TASK_SEARCH_CONFIG = "simple"   # no stemming: titles come in any language from the providers
+TASK_SEARCH_VECTOR = (
+    f"setweight(to_tsvector('{TASK_SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+    f"setweight(to_tsvector('{TASK_SEARCH_CONFIG}', coalesce(description, '')), 'B')"
+)
+
+
 class Task(Base):
     __tablename__ = "tasks"
     
     id              = Column(Integer,                                               nullable=False, primary_key=True)
     user_id         = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"),   nullable=False)
-    source          = Column(String,                                                nullable=False) # google_classroom
+    source          = Column(enum_column(TaskSource, "task_source"),                nullable=False)
     added_at        = Column(TIMESTAMP(timezone=True),                              nullable=False, server_default=text("now()")) 
     updated_at      = Column(TIMESTAMP(timezone=True),                              nullable=True , server_default=text("now()"))
     
     title           = Column(String,                                                nullable=False)
     description     = Column(String,                                                nullable=False, server_default="")
-    status          = Column(String,                                                nullable=False)
+    status          = Column(enum_column(TaskStatus, "task_status"),                nullable=False)
     deadline        = Column(TIMESTAMP(timezone=True),                              nullable=True)
     
-    priority        = Column(String,                                                nullable=False)
-    category        = Column(String,                                                nullable=False)
+    priority        = Column(enum_column(TaskPriority, "task_priority"),            nullable=False)
+    category        = Column(enum_column(TaskCategory, "task_category"),            nullable=False)
     
     # Integrations sync task id (ALL external IDs in ONE COLUMN)
-    integration_provider_task_id = Column(String,                                            nullable=True, unique=True)
+    integration_provider_task_id = Column(String,                                            nullable=True)
+    
+    # the user's tasks_version of the last write of this task (change feed position)
+    change_seq      = Column(BigInteger,                                            nullable=False, server_default=text("0"))
+    
+    # full-text search document, kept up to date by Postgres on every insert and update (title weighs more than description);
+    # deferred: only the search filter reads it, loading tasks never fetches it
+    search_vector   = deferred(Column(TSVECTOR, Computed(TASK_SEARCH_VECTOR, persisted=True)))
     
     owner = relationship("User")
+    
+    # keyset pagination of GET /api/tasks walks (deadline, id) per user, optionally narrowed by status or source
+    __table_args__ = (
+        Index("ix_tasks_user_deadline_id", "user_id", "deadline", "id"),
+        Index("ix_tasks_user_status_deadline_id", "user_id", "status", "deadline", "id"),
+        Index("ix_tasks_user_source_deadline_id", "user_id", "source", "deadline", "id"),
+        Index("ix_tasks_user_change_seq_id", "user_id", "change_seq", "id"),
+        # btree_gin: one index scan finds a user's matches instead of AND-ing every user's matches with ix_tasks_user_*
+        Index("ix_tasks_user_search_vector", "user_id", "search_vector", postgresql_using="gin"),
+        # provider syncs upsert on it; several users can hold the same provider item (shared course, meeting)
+        Index("uq_tasks_user_provider_task_id", "user_id", "integration_provider_task_id", unique=True),
+    )
+
+
+event.listen(Task.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS btree_gin"))
+
+
+class TaskTombstone(Base):
+    __tablename__ = "task_tombstones"
+    
+    # deletion log of the change feed, swept after `task_tombstone_retention_days`
+    id              = Column(Integer,                                               primary_key=True)
+    user_id         = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"),   nullable=False)
+    task_id         = Column(Integer,                                               nullable=False)
+    integration_provider_task_id = Column(String,                                            nullable=True)
+    change_seq      = Column(BigInteger,                                            nullable=False)
+    deleted_at      = Column(TIMESTAMP(timezone=True),                              nullable=False, server_default=text("now()"))
+    
+    __table_args__ = (
+        Index("ix_task_tombstones_user_change_seq_task", "user_id", "change_seq", "task_id"),
+        Index("ix_task_tombstones_deleted_at", "deleted_at"),
+    )
 
 
 
@@ -1,13 +1,19 @@
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Query
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import update, delete, select
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta 
+from cachetools import TTLCache
+from datetime import datetime, timedelta, timezone
 from jose import jwt, JWTError
+import hashlib, hmac, threading, uuid
 
 from app import schemas, database, models 
 from app.config import settings
+from app.utils import token_revocation
+from app.utils.token_revocation import revocation_list
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login", auto_error=False)
 SECRET_KEY = settings.secret_key
 ALGORITHM = settings.algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
@@ -18,8 +24,9 @@ REFRESH_TOKEN_EXPIRE_DAYS = settings.refresh_token_expire_days
 
 def create_access_token(data: dict, expires_delta=ACCESS_TOKEN_EXPIRE_MINUTES):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=expires_delta)
-    to_encode.update({'exp': expire})
+    now = datetime.utcnow()
+    expire = now + timedelta(minutes=expires_delta)
+    to_encode.update({'exp': expire, 'iat': now, 'jti': uuid.uuid4().hex})
     
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
@@ -30,9 +37,10 @@ def verify_access_token(token: str, credentials_exception):
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         id: str = payload.get("user_id")
         
-        if id is None:
+        # refresh, password reset and email verification tokens carry a scope and are never access tokens
+        if id is None or payload.get("scope") is not None:
             raise credentials_exception
-        token_data = schemas.TokenData(id=str(id))
+        token_data = schemas.TokenData(id=str(id), jti=payload.get("jti"), issued_at=payload.get("iat"), expires_at=payload.get("exp"))
     
     except JWTError:
         raise credentials_exception
@@ -54,29 +62,202 @@ def verify_refresh_token(token: str, credentials_exception):
         if payload.get("scope") != "refresh_token":
             raise credentials_exception
         id: str = payload.get("user_id")
-        if id is None:
+        if id is None or payload.get("jti") is None:
             raise credentials_exception
-        return schemas.TokenData(id=str(id))
+        return payload
     except JWTError:
         raise credentials_exception
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def refresh_token_digest(token: str) -> str:
+    # refresh tokens are long random JWTs, a keyed fast hash is enough (bcrypt would also only read their first 72 bytes)
+    return hmac.new(SECRET_KEY.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+
+def issue_refresh_token(db: Session, user_id: int, family_id: str | None = None, expire_days: int = REFRESH_TOKEN_EXPIRE_DAYS) -> str:
+    """
+    Create and store a refresh token; without `family_id` it starts a new login (device) family. Commits.
+    """
+    jti = uuid.uuid4().hex
+    family_id = family_id or uuid.uuid4().hex
+    token = create_refresh_token({"user_id": user_id, "jti": jti}, expire_days)
+
+    db.add(models.RefreshToken(
+        jti=jti,
+        user_id=user_id,
+        family_id=family_id,
+        token_digest=refresh_token_digest(token),
+        expires_at=datetime.now(timezone.utc) + timedelta(days=expire_days),
+    ))
+    db.commit()
+    
+    return token
+
+
+def rotate_refresh_token(db: Session, token: str, credentials_exception) -> tuple[int, str]:
+    """
+    Spend a refresh token and return `(user_id, new refresh token)` of the same family.
+    The valid path is one UPDATE ... RETURNING on the unique jti; presenting a token that was already
+    rotated (stolen and replayed, or replayed by the thief) revokes its whole family, unless it was rotated
+    within the grace window: near-simultaneous refreshes of one client just get a 401.
+    """
+    payload = verify_refresh_token(token, credentials_exception)
+    now = datetime.now(timezone.utc)
+
+    spent = db.execute(
+        update(models.RefreshToken).where(
+            models.RefreshToken.jti == payload["jti"],
+            models.RefreshToken.token_digest == refresh_token_digest(token),
+            models.RefreshToken.used_at.is_(None),
+            models.RefreshToken.revoked_at.is_(None),
+            models.RefreshToken.expires_at > now,
+        ).values(used_at=now).returning(models.RefreshToken.user_id, models.RefreshToken.family_id)
+    ).first()
+
+    if spent is None:
+        stored = db.execute(select(models.RefreshToken.family_id, models.RefreshToken.token_digest, models.RefreshToken.used_at).where(models.RefreshToken.jti == payload["jti"])).first()
+        reused = stored and stored.used_at and hmac.compare_digest(stored.token_digest, refresh_token_digest(token))
+        if reused and now - stored.used_at > timedelta(seconds=settings.refresh_token_reuse_grace_seconds):
+            revoke_refresh_tokens(db, family_id=stored.family_id)
+            db.commit()
+            print(f"Refresh token reuse detected, family {stored.family_id} revoked")
+        raise credentials_exception
+
+    return spent.user_id, issue_refresh_token(db, spent.user_id, spent.family_id)
+
+
+def revoke_refresh_tokens(db: Session, user_id: int | None = None, family_id: str | None = None):
+    # caller commits
+    query = update(models.RefreshToken).where(models.RefreshToken.revoked_at.is_(None))
+    query = query.where(models.RefreshToken.user_id == user_id) if user_id is not None else query.where(models.RefreshToken.family_id == family_id)
+    db.execute(query.values(revoked_at=datetime.now(timezone.utc)))
+
+
+def end_all_sessions(db: Session, user: models.User, access_token: str | None = None):
+    """
+    Invalidate every access and refresh token of the user (logout, password reset). Commits.
+    The epoch only has whole-second precision (`iat`), so the presented `access_token`, possibly issued
+    in the same second, is also revoked by its jti.
+    """
+    now = datetime.now(timezone.utc)
+    user.tokens_invalid_before = now
+    revoke_refresh_tokens(db, user_id=user.id)
+    token_revocation.revoke_user_access_tokens(db, user.id, now)
+
+    token = None
+    if access_token:
+        credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+        token = verify_access_token(access_token, credentials_exception)
+        if token.jti:
+            token_revocation.revoke_access_token(db, token.jti, user.id, datetime.fromtimestamp(token.expires_at, timezone.utc))
+    db.commit()
+    
+    revocation_list.add(None, user.id, now, now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    if token and token.jti:
+        revocation_list.add(token.jti, user.id, None, datetime.fromtimestamp(token.expires_at, timezone.utc))
+    invalidate_principal(user.id)
+
+
+def end_session(db: Session, access_token: str, refresh_token: str | None = None):
+    """
+    Revoke one access token and, when given, the refresh token family of the same device. Commits.
+    """
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+    token = verify_access_token(access_token, credentials_exception)
+    expires_at = datetime.fromtimestamp(token.expires_at, timezone.utc)
+
+    if token.jti:
+        token_revocation.revoke_access_token(db, token.jti, int(token.id), expires_at)
+
+    if refresh_token:
+        payload = verify_refresh_token(refresh_token, credentials_exception)
+        family_id = db.execute(select(models.RefreshToken.family_id).where(
+            models.RefreshToken.jti == payload["jti"], models.RefreshToken.user_id == int(token.id))).scalar_one_or_none()
+        if family_id:
+            revoke_refresh_tokens(db, family_id=family_id)
+
+    db.commit()
+    revocation_list.add(token.jti, int(token.id), None, expires_at)
+
+
+def sweep_refresh_tokens(db: Session, batch_size: int = settings.refresh_token_sweep_batch_size) -> int:
+    # expired rows in small batches, so the sweep never holds long locks on a big table
+    swept = 0
+    while True:
+        expired = select(models.RefreshToken.id).where(models.RefreshToken.expires_at < datetime.now(timezone.utc)).limit(batch_size).scalar_subquery()
+        result = db.execute(delete(models.RefreshToken).where(models.RefreshToken.id.in_(expired)))
+        db.commit()
+        swept += result.rowcount
+        if result.rowcount < batch_size:
+            return swept
+
+
+# user_id -> Principal, so authenticated requests skip the users lookup; every change of those fields must call invalidate_principal
+principal_cache = TTLCache(maxsize=settings.principal_cache_size, ttl=settings.principal_cache_ttl_seconds)
+principal_cache_stats = {"hits": 0, "misses": 0}
+_principal_cache_lock = threading.Lock()
+
+
+def get_principal(user_id: int, db: Session) -> schemas.Principal | None:
+    with _principal_cache_lock:
+        principal = principal_cache.get(user_id)
+        if principal is not None:
+            principal_cache_stats["hits"] += 1
+            return principal
+        principal_cache_stats["misses"] += 1
+
+    row = db.query(models.User.id, models.User.is_verified, models.User.tokens_invalid_before).filter(models.User.id == user_id).first()
+    if row is None:
+        return None
+
+    principal = schemas.Principal(id=row.id, is_verified=row.is_verified, tokens_invalid_before=row.tokens_invalid_before)
+    with _principal_cache_lock:
+        principal_cache[user_id] = principal
+    
+    return principal
+
+
+def invalidate_principal(user_id: int):
+    # call after the commit, so the next lookup can't cache the old row again
+    with _principal_cache_lock:
+        principal_cache.pop(user_id, None)
+
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> schemas.Principal:
     
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
     
     token = verify_access_token(token, credentials_exception)
-    user = db.query(models.User).filter(models.User.id == token.id).first()
+    
+    # in-memory lookups only, kept current by the revocation list refresh
+    if revocation_list.is_revoked(token.jti, int(token.id), token.issued_at):
+        raise credentials_exception
+    
+    user = get_principal(int(token.id), db)
     
     if not user:
         raise credentials_exception
     
+    # iat has second precision, tokens issued in the second of the invalidation stay valid
+    if user.tokens_invalid_before and (token.issued_at or 0) < int(user.tokens_invalid_before.timestamp()):
+        raise credentials_exception
+    
     if not user.is_verified:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Please verify your email first")
     
     return user 
 
 
+# browsers' EventSource can't send headers, so push streams also accept the access token as `?access_token=`
+def get_current_stream_user(token: str | None = Depends(optional_oauth2_scheme), access_token: str | None = Query(None), db: Session = Depends(database.get_db)):
+    
+    token = token or access_token
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    
+    return get_current_user(token, db)
+
+
 def create_reset_password_token(user_id: int, expires_minutes: int = RESET_PASSWORD_TOKEN_EXPIRE_MINTUES):
     expire = datetime.utcnow() + timedelta(minutes=expires_minutes)
     payload = {
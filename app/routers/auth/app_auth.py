@@ -1,20 +1,42 @@
-from fastapi import Depends, status, HTTPException, APIRouter
+from fastapi import Depends, status, HTTPException, APIRouter, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm 
+from fastapi_utils.tasks import repeat_every
 from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
 
 from app import schemas, models, oauth2
-from app.utils import crypt_utils
+from app.utils import crypt_utils, token_revocation
 from app.utils.email_utils import send_reset_email
-from app.database import get_db 
+from app.config import settings
+from app.database import get_db, SessionLocal
 
 from app.routers.integrations import sync_task
 
 router = APIRouter(prefix="/api/auth", tags=["App-Auth"])
 
 
+@router.on_event("startup")
+@repeat_every(seconds=settings.refresh_token_sweep_seconds)
+def sweep_refresh_tokens():
+    db = SessionLocal()
+    try:
+        oauth2.sweep_refresh_tokens(db)
+        token_revocation.sweep_revocations(db)
+    finally:
+        db.close()
+
+
+@router.on_event("startup")
+@repeat_every(seconds=settings.token_revocation_refresh_seconds)
+def refresh_revocation_list():
+    db = SessionLocal()
+    try:
+        token_revocation.revocation_list.refresh(db)
+    finally:
+        db.close()
+
+
 @router.post('/login', response_model=schemas.Token, status_code=status.HTTP_200_OK)
-def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+def login(background_tasks: BackgroundTasks, user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     
     user = db.query(models.User).filter(models.User.email == user_credentials.username).first()
     
@@ -27,8 +49,12 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session =
     if not user.is_verified:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Please verify your email first from your mailbox.")
 
+    # hashed with an older cost factor: upgrade it after the response is sent
+    if crypt_utils.needs_rehash(user.password):
+        background_tasks.add_task(rehash_password, user.id, user.password, user_credentials.password)
+
     access_token = oauth2.create_access_token(data = {"user_id": user.id})
-    refresh_token = oauth2.create_refresh_token(data={"user_id": user.id})
+    refresh_token = oauth2.issue_refresh_token(db, user.id)
 
     return {
         "access_token": access_token,
@@ -37,40 +63,44 @@ def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session =
     }
 
 
+def rehash_password(user_id: int, old_hash: str, password: str):
+    new_hash = crypt_utils.hash(password)
+    
+    db = SessionLocal()
+    try:
+        # only if the password did not change meanwhile
+        db.query(models.User).filter(models.User.id == user_id, models.User.password == old_hash).update({"password": new_hash}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
 @router.post('/logout')
-def logout(current_user: models.User = Depends(oauth2.get_current_user), db: Session = Depends(get_db)):
-    current_user.refresh_token = None
-    current_user.refresh_token_expiry = None
-    db.commit()
+def logout(token: str = Depends(oauth2.oauth2_scheme), current_user: schemas.Principal = Depends(oauth2.get_current_user), db: Session = Depends(get_db)):
+    user = db.query(models.User).filter(models.User.id == current_user.id).first()
+    # every device: all refresh tokens and every access token issued until now, including the presented one
+    oauth2.end_all_sessions(db, user, token)
     return {"detail": "Logged out successfully"}
 
 
-@router.post('/refresh-token', status_code=status.HTTP_200_OK)
-def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
-
-    token_data = oauth2.verify_refresh_token(refresh_token, credentials_exception)
-    
-    user = db.query(models.User).filter(models.User.id == token_data.id).first()
-    if not user or not user.refresh_token or not crypt_utils.verify(refresh_token, user.refresh_token):
-        raise credentials_exception
+# logs out this device only: the presented access token and, if sent, its refresh token family
+@router.post('/revoke')
+def revoke(refresh_token: str | None = None, token: str = Depends(oauth2.oauth2_scheme), current_user: schemas.Principal = Depends(oauth2.get_current_user), db: Session = Depends(get_db)):
+    oauth2.end_session(db, token, refresh_token)
+    return {"detail": "Session revoked"}
 
-    if not crypt_utils.verify(refresh_token, user.refresh_token):
-            raise credentials_exception
 
-    if user.refresh_token_expiry and user.refresh_token_expiry < datetime.utcnow():
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token expired")
+@router.post('/refresh-token', status_code=status.HTTP_200_OK)
+def refresh_token(refresh_token: str, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-    new_refresh_token = oauth2.create_refresh_token(data={"user_id": user.id})
-    user.refresh_token = crypt_utils.hash(new_refresh_token)
-    user.refresh_token_expiry = datetime.utcnow() + timedelta(days=7)
-    db.commit()
+    # single use: the presented token is spent and a new one of the same family is issued
+    user_id, new_refresh_token = oauth2.rotate_refresh_token(db, refresh_token, credentials_exception)
 
-    new_access_token = oauth2.create_access_token(data={"user_id": user.id})
+    new_access_token = oauth2.create_access_token(data={"user_id": user_id})
     
-    # TODO i want to put here sync_all_user_integration_data func 
-    # as for every refresh tokens get all also refresh it's data  
-    sync_task.sync_user(user)   
+    # as for every refresh tokens get all also refresh it's data (after the response is sent)
+    background_tasks.add_task(sync_task.sync_user_integrations, user_id)
 
     
     return {
@@ -102,7 +132,7 @@ def reset_password(token: str, new_password: str, db: Session = Depends(get_db))
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     
     user.password = crypt_utils.hash(new_password)
-    db.commit()
+    oauth2.end_all_sessions(db, user)
     
     return {"msg": "Password updated successfully"}
 
@@ -123,9 +153,10 @@ def verify_email(token: str, db: Session = Depends(get_db)):
     
     user.is_verified = True
     db.commit()
+    oauth2.invalidate_principal(user.id)
 
     access_token = oauth2.create_access_token({"user_id": user.id})
-    refresh_token = oauth2.create_refresh_token(data={"user_id": user.id})
+    refresh_token = oauth2.issue_refresh_token(db, user.id)
     
     return {
         "access_token": access_token,
@@ -7,7 +7,7 @@ import json, jwt
 from app.database import get_db
 from app.config import settings
 from app.utils import crypt_utils
-from app import models, oauth2
+from app import models, oauth2, schemas
 
 
 
@@ -25,7 +25,7 @@ async def apple_signup():
 
 
 @router.get("/connect")
-async def apple_login(current_user: models.User = Depends(oauth2.get_current_user)):
+async def apple_login(current_user: schemas.Principal = Depends(oauth2.get_current_user)):
     return RedirectResponse(url=build_apple_auth_url("signup", current_user.id))
 
 @router.get("/callback/login")
@@ -44,7 +44,7 @@ async def apple_login_callback(request: Request, db: Session = Depends(get_db)):
 
     return {
         "access_token": oauth2.create_access_token({"user_id": auth_provider.user_id}),
-        "refresh_token": oauth2.create_refresh_token({"user_id": auth_provider.user_id}),
+        "refresh_token": oauth2.issue_refresh_token(db, auth_provider.user_id),
         "token_type": "bearer",
         "service_type": "login",
         "apple_user": apple_user
@@ -105,8 +105,8 @@ async def apple_signup_callback(request: Request, db: Session = Depends(get_db))
     db.refresh(auth_provider)
 
     return {
-        "access_token": oauth2.create_access_token({"user_id": user.id}),
-        "refresh_token": oauth2.create_refresh_token({"user_id": user.id}),
+        "access_token": oauth2.create_access_token({"user_id": user_id}),
+        "refresh_token": oauth2.issue_refresh_token(db, user_id),
         "token_type": "bearer",
         "service_type": "signup",
         "apple_user": apple_user
@@ -2,12 +2,12 @@ from fastapi import APIRouter, Request, HTTPException, status, Depends
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from urllib.parse import urlencode, quote, unquote
-import json, requests, datetime
+import json, datetime
 
 from app.database import get_db
-from app.utils import crypt_utils
+from app.utils import crypt_utils, http_client
 from app.config import settings
-from app import models, oauth2
+from app import models, oauth2, schemas
 
 
 router = APIRouter(prefix="/api/auth/facebook", tags=["Facebook-Auth"])
@@ -24,7 +24,7 @@ async def facebook_signup():
 
 
 @router.get("/connect")
-async def facebook_connect(current_user: models.User = Depends(oauth2.get_current_user)):
+async def facebook_connect(current_user: schemas.Principal = Depends(oauth2.get_current_user)):
     return RedirectResponse(url=build_facebook_auth_url("signup", current_user.id)) 
 
 
@@ -35,8 +35,8 @@ async def facebook_login_callback(request: Request, db: Session = Depends(get_db
     if not code:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Missing code")
 
-    tokens = exchange_code_for_token(code, "login")
-    fb_user = get_facebook_user(tokens["access_token"])
+    tokens = await exchange_code_for_token(code, "login")
+    fb_user = await get_facebook_user(tokens["access_token"])
 
     fb_email = fb_user.get("email")
     
@@ -47,7 +47,7 @@ async def facebook_login_callback(request: Request, db: Session = Depends(get_db
 
     return {
         "access_token": oauth2.create_access_token({"user_id": auth.user_id}),
-        "refresh_token": oauth2.create_refresh_token({"user_id": auth.user_id}),
+        "refresh_token": oauth2.issue_refresh_token(db, auth.user_id),
         "token_type": "bearer",
         "service_type": "login",
         "facebook_user": fb_user
@@ -62,8 +62,8 @@ async def facebook_signup_callback(request: Request, db: Session = Depends(get_d
     if not code or not state:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Missing code or state")
 
-    tokens = exchange_code_for_token(code, "signup")
-    fb_user = get_facebook_user(tokens["access_token"])
+    tokens = await exchange_code_for_token(code, "signup")
+    fb_user = await get_facebook_user(tokens["access_token"])
 
     fb_email = fb_user.get("email")
     
@@ -107,8 +107,8 @@ async def facebook_signup_callback(request: Request, db: Session = Depends(get_d
     db.refresh(auth_provider)
     
     return {
-        "access_token": oauth2.create_access_token({"user_id": user.id}),
-        "refresh_token": oauth2.create_refresh_token({"user_id": user.id}),
+        "access_token": oauth2.create_access_token({"user_id": user_id}),
+        "refresh_token": oauth2.issue_refresh_token(db, user_id),
         "token_type": "bearer",
         "service_type": "signup",
         "facebook_user": fb_user
@@ -135,22 +135,22 @@ def build_facebook_auth_url(service_type: str, user_id: int | None = None):
     return f"https://www.facebook.com/v16.0/dialog/oauth?{urlencode(params)}"
 
 
-def exchange_code_for_token(code: str, service_type: str):
+async def exchange_code_for_token(code: str, service_type: str):
     params = {
         "client_id": settings.facebook_client_id,
         "redirect_uri": settings.facebook_redirect_uri(service_type),
         "client_secret": settings.facebook_client_secret,
         "code": code
     }
-    resp = requests.get("https://graph.facebook.com/v16.0/oauth/access_token", params=params)
+    resp = await http_client.aget("https://graph.facebook.com/v16.0/oauth/access_token", params=params)
     if not resp.ok:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to get token from Facebook")
     return resp.json()
 
 
-def get_facebook_user(access_token: str):
+async def get_facebook_user(access_token: str):
     fields = "id,first_name,last_name,email"
-    resp = requests.get(f"https://graph.facebook.com/me?fields={fields}&access_token={access_token}")
+    resp = await http_client.aget("https://graph.facebook.com/me", params={"fields": fields, "access_token": access_token})
     if not resp.ok:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to fetch Facebook user info")
     return resp.json()
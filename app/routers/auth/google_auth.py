@@ -2,11 +2,11 @@ from fastapi import APIRouter, Depends, Request, HTTPException, status
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from urllib.parse import unquote
-import json 
+import asyncio, json 
 
 from app.database import get_db
 from app.utils import google_utils, crypt_utils
-from app import models, oauth2
+from app import models, oauth2, schemas
 
 
 
@@ -24,7 +24,7 @@ async def google_signup():
 
 
 @router.get("/connect")
-async def google_connect(current_user: models.User = Depends(oauth2.get_current_user)):
+async def google_connect(current_user: schemas.Principal = Depends(oauth2.get_current_user)):
     return RedirectResponse(url=google_utils.build_google_auth_url("signup", current_user.id)) 
 
 
@@ -35,8 +35,8 @@ async def google_login_callback(request: Request, db: Session = Depends(get_db))
     if not code:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Missing code or state")
 
-    tokens = google_utils.get_google_tokens(code, "login")
-    user_info = google_utils.get_google_user_info(tokens["access_token"])
+    tokens = await google_utils.get_google_tokens(code, "login")
+    user_info = await google_utils.get_google_user_info(tokens["access_token"])
     
     google_email = user_info.get("email") 
 
@@ -47,7 +47,7 @@ async def google_login_callback(request: Request, db: Session = Depends(get_db))
 
     return {
         "access_token": oauth2.create_access_token({"user_id": auth .user_id}),
-        "refresh_token": oauth2.create_refresh_token({"user_id": auth.user_id}),
+        "refresh_token": oauth2.issue_refresh_token(db, auth.user_id),
         "token_type": "bearer",
         "service_type": "login",
         "google_user": user_info,
@@ -64,8 +64,15 @@ async def google_signup_callback(request: Request, db: Session = Depends(get_db)
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Missing code or state")
     
 
-    tokens = google_utils.get_google_tokens(code, "signup")
-    user_info = google_utils.get_google_user_info(tokens["access_token"])
+    user_id = json.loads(crypt_utils.decrypt(unquote(state))).get("user_id", None)
+
+    tokens = await google_utils.get_google_tokens(code, "signup")
+    
+    # profile and birthday are independent calls, a new account needs both
+    if user_id:
+        user_info, birthday = await google_utils.get_google_user_info(tokens["access_token"]), None
+    else:
+        user_info, birthday = await asyncio.gather(google_utils.get_google_user_info(tokens["access_token"]), google_utils.get_google_birthday(tokens["access_token"]))
     
     google_email = user_info.get("email")
 
@@ -74,10 +81,7 @@ async def google_signup_callback(request: Request, db: Session = Depends(get_db)
     if existing_provider:
         raise HTTPException(status.HTTP_409_CONFLICT, "Email already registered")
     
-    user_id = json.loads(crypt_utils.decrypt(unquote(state))).get("user_id", None)
-    
     if not user_id:
-        birthday = google_utils.get_google_birthday(tokens["access_token"])
         user = models.User(
             first_name=user_info.get("given_name"),
             last_name=user_info.get("family_name"),
@@ -103,8 +107,8 @@ async def google_signup_callback(request: Request, db: Session = Depends(get_db)
     db.refresh(auth_provider)
     
     return {
-        "access_token": oauth2.create_access_token({"user_id": user.id}),
-        "refresh_token": oauth2.create_refresh_token({"user_id": user.id}),
+        "access_token": oauth2.create_access_token({"user_id": user_id}),
+        "refresh_token": oauth2.issue_refresh_token(db, user_id),
         "token_type": "bearer",
         "service_type": "signup",
         "google_user": user_info,
@@ -1,19 +1,23 @@
 from fastapi import APIRouter, Depends, Request, HTTPException, status
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from datetime import datetime, timezone
 from urllib.parse import unquote
-import json, requests
+import json
 
 from app.config import settings
 from app import models
 from app.database import get_db
-from app.utils import crypt_utils, google_utils
+from app.utils import crypt_utils, google_utils, http_client, sync_utils, token_manager
 from app.oauth2 import get_current_user
 
 
 router = APIRouter(prefix="/api/integrations/google", tags=["Google Classroom"])
 
+CLASSROOM_PAGE_SIZE = 100
+
 
 
 @router.get("/classroom")
@@ -41,7 +45,7 @@ async def google_classroom_auth_callback(request: Request, db: Session = Depends
     if user_integration:
         raise HTTPException(status.HTTP_409_CONFLICT, "User already connected before.")
 
-    tokens = google_utils.get_google_tokens(code, "google_classroom")
+    tokens = await google_utils.get_google_tokens(code, "google_classroom")
 
     google_utils.handle_token_save(user, tokens, db, "google_classroom")
 
@@ -128,7 +132,9 @@ async def google_classroom_auth_callback(request: Request, db: Session = Depends
 #     return {"message": "Google Classroom synced successfully for user"}
 
 @router.get("/classroom/{user_id}/sync")
-def sync_user_google_classroom(user_id: int, db: Session = Depends(get_db)):
+def sync_user_google_classroom(user_id: int, full_sync: bool = False, db: Session = Depends(get_db)):
+    started_at = datetime.now(timezone.utc)
+    
     # 1️⃣ Get user
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
@@ -142,98 +148,111 @@ def sync_user_google_classroom(user_id: int, db: Session = Depends(get_db)):
     if not user_integration:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not connected to Google Classroom")
 
-    # 3️⃣ Decrypt access token
-    access_token = crypt_utils.decrypt(user_integration.access_token)
+    # 3️⃣ Get a fresh access token (refreshed shortly before it expires)
+    access_token = token_manager.get_access_token(user_integration, db)
     headers = {"Authorization": f"Bearer {access_token}"}
+    fetch_items = partial(get_classroom_items, headers=headers, token_key=user_integration.id, budget=http_client.RetryBudget())
 
     # 4️⃣ Get courses
-    courses_res = requests.get("https://classroom.googleapis.com/v1/courses", headers=headers)
-    courses_data = courses_res.json()
-    if "error" in courses_data:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Google API Error: {courses_data['error']['message']}")
+    try:
+        courses = fetch_items("https://classroom.googleapis.com/v1/courses", "courses")
+    except ValueError as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Google API Error: {e}")
 
-    courses = courses_data.get("courses", [])
     if not courses:
+        sync_utils.advance_sync_cursor(user_integration, started_at)
+        db.commit()
         return {"message": "No courses found for this user."}
 
-    tasks_synced = 0
-
-    # 5️⃣ Iterate courses
-    for course in courses:
-        course_id = course["id"]
-
-        # 6️⃣ Get all coursework for the course
-        coursework_res = requests.get(
-            f"https://classroom.googleapis.com/v1/courses/{course_id}/courseWork",
-            headers=headers
-        )
-        coursework_data = coursework_res.json()
-        if "error" in coursework_data:
-            print(f"Google Classroom error for course {course_id}: {coursework_data}")
-            continue
-
-        coursework_list = coursework_data.get("courseWork", [])
-
-        # 7️⃣ Iterate coursework
-        for cw in coursework_list:
-            work_id = cw["id"]
-
-            # 8️⃣ Get student's submissions
-            submissions_res = requests.get(
-                f"https://classroom.googleapis.com/v1/courses/{course_id}/courseWork/{work_id}/studentSubmissions?userId=me",
-                headers=headers
-            )
-            submissions_data = submissions_res.json()
-            if "error" in submissions_data:
-                print(f"Student submission error for coursework {work_id}: {submissions_data}")
-                continue
-
-            student_submissions = submissions_data.get("studentSubmissions", [])
-            if not student_submissions:
-                continue  # student not enrolled or no submission
-
-            # 9️⃣ Parse due date
-            if "dueDate" in cw:
-                due_date = datetime(
-                    cw["dueDate"]["year"],
-                    cw["dueDate"]["month"],
-                    cw["dueDate"]["day"],
-                    cw.get("dueTime", {}).get("hours", 23),
-                    cw.get("dueTime", {}).get("minutes", 59),
-                    tzinfo=timezone.utc
-                )
-            else:
-                due_date = datetime.now(timezone.utc)
-
-            # 10️⃣ Prepare task
-            task_data = {
-                "title": cw.get("title", "Untitled"),
-                "description": cw.get("description", ""),
-                "deadline": due_date,
-                "status": "In progress",
-                "category": "Classroom",
-                "priority": "Medium",
-                "source": "Google Classroom",
-                "integration_provider_task_id": work_id,
-                "updated_at": cw.get("updateTime")
-            }
-
-            # 11️⃣ Update or insert task in DB
-            task_in_db = db.query(models.Task).filter(
-                models.Task.integration_provider_task_id == work_id,
-                models.Task.user_id == user.id
-            ).first()
-
-            if task_in_db:
-                for key, value in task_data.items():
-                    setattr(task_in_db, key, value)
-            else:
-                new_task = models.Task(**task_data, user_id=user.id)
-                db.add(new_task)
-                tasks_synced += 1
-
-        db.commit()
+    upserter = sync_utils.TaskUpserter(db, user.id, "Google Classroom")
+    cursor = sync_utils.get_sync_cursor(user_integration, full_sync)
+
+    # 5️⃣ Fetch the changed coursework + the student's submissions of every course concurrently
+    with ThreadPoolExecutor(max_workers=settings.classroom_sync_max_concurrency) as pool:
+        course_results = pool.map(lambda course: get_course_assignments(course["id"], fetch_items, cursor), courses)
+
+        for coursework_list in course_results:
+
+            # 6️⃣ Iterate coursework the student has submissions for
+            for cw in coursework_list:
+                work_id = cw["id"]
+
+                # 7️⃣ Parse due date
+                if "dueDate" in cw:
+                    due_date = datetime(
+                        cw["dueDate"]["year"],
+                        cw["dueDate"]["month"],
+                        cw["dueDate"]["day"],
+                        cw.get("dueTime", {}).get("hours", 23),
+                        cw.get("dueTime", {}).get("minutes", 59),
+                        tzinfo=timezone.utc
+                    )
+                else:
+                    due_date = datetime.now(timezone.utc)
+
+                # 8️⃣ Queue task for the bulk upsert
+                upserter.add({
+                    "title": cw.get("title", "Untitled"),
+                    "description": cw.get("description", ""),
+                    "deadline": due_date,
+                    "status": "In progress",
+                    "category": "Classroom",
+                    "priority": "Medium",
+                    "source": "Google Classroom",
+                    "integration_provider_task_id": work_id,
+                    "updated_at": cw.get("updateTime")
+                })
+
+    # 9️⃣ Write all new and changed tasks (and the new cursor) in one transaction
+    sync_utils.advance_sync_cursor(user_integration, started_at)
+    result = upserter.commit()
 
     return {
-        "message": f"Google Classroom synced successfully for userf"
+        "message": "Google Classroom synced successfully for user",
+        "tasks_synced": result["inserted"] + result["updated"],
     }
+
+
+def get_course_assignments(course_id: str, fetch_items, cursor: datetime | None = None) -> list[dict]:
+    """
+    Return the course's coursework updated after `cursor` that the student has submissions for.
+    The `courseWork/-` wildcard returns the student's submissions for every coursework of the course
+    in a few paginated calls instead of one call per coursework.
+    """
+    base_url = f"https://classroom.googleapis.com/v1/courses/{course_id}"
+
+    try:
+        coursework_list = fetch_items(f"{base_url}/courseWork", "courseWork")
+        
+        # the API has no server-side updateTime filter, so deltas are picked here before any submission lookup
+        if cursor:
+            coursework_list = [cw for cw in coursework_list if (sync_utils.parse_provider_datetime(cw.get("updateTime")) or cursor) >= cursor]
+        if not coursework_list:
+            return []
+
+        submissions = fetch_items(f"{base_url}/courseWork/-/studentSubmissions", "studentSubmissions", {"userId": "me"})
+    except ValueError as e:
+        print(f"Google Classroom error for course {course_id}: {e}")
+        return []
+
+    # student not enrolled or no submission
+    submitted_work_ids = {submission["courseWorkId"] for submission in submissions}
+    
+    return [cw for cw in coursework_list if cw["id"] in submitted_work_ids]
+
+
+def get_classroom_items(url: str, items_key: str, params: dict | None = None, *, headers: dict, token_key: int, budget: http_client.RetryBudget) -> list[dict]:
+    params = {**(params or {}), "pageSize": CLASSROOM_PAGE_SIZE}
+    items = []
+
+    while True:
+        data = http_client.provider_request("GET", url, "google", token_key, budget, headers=headers, params=params).json()
+        if "error" in data:
+            raise ValueError(data["error"].get("message", data["error"]))
+
+        items.extend(data.get(items_key, []))
+
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            return items
+        params["pageToken"] = page_token
@@ -1,14 +1,14 @@
 from fastapi import APIRouter, Depends, Request,HTTPException, status
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timezone
 from urllib.parse import unquote
-import json, requests
+import json
 
 from app.config import settings
 from app import models
 from app.database import get_db
-from app.utils import crypt_utils, google_utils
+from app.utils import crypt_utils, google_utils, http_client, sync_utils, token_manager
 from app.oauth2 import get_current_user
 
 router = APIRouter(prefix="/api/integrations/google", tags=["Google Tasks"])
@@ -40,7 +40,7 @@ async def google_tasks_auth_callback(request: Request, db: Session = Depends(get
     if user_integration: 
         raise HTTPException(status.HTTP_409_CONFLICT, "User already connected before.")
 
-    tokens = google_utils.get_google_tokens(code, "google_tasks")
+    tokens = await google_utils.get_google_tokens(code, "google_tasks")
     
     google_utils.handle_token_save(user, tokens, db, "google_tasks")
 
@@ -51,8 +51,9 @@ async def google_tasks_auth_callback(request: Request, db: Session = Depends(get
 # def sync_user_google_tasks(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
 #     user_id = current_user.id
 @router.get("/tasks/{user_id}/sync")
-def sync_user_google_tasks(user_id: int, db: Session = Depends(get_db)):
+def sync_user_google_tasks(user_id: int, full_sync: bool = False, db: Session = Depends(get_db)):
     
+    started_at = datetime.now(timezone.utc)
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not Found")
@@ -61,21 +62,20 @@ def sync_user_google_tasks(user_id: int, db: Session = Depends(get_db)):
     if not user_integration:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not connected to Google Tasks")
     
-    access_token = crypt_utils.decrypt(user_integration.access_token)
+    access_token = token_manager.get_access_token(user_integration, db)
     headers = {"Authorization": f"Bearer {access_token}"}
+    budget = http_client.RetryBudget()
 
-    res = requests.get("https://tasks.googleapis.com/tasks/v1/users/@me/lists", headers=headers)
+    res = http_client.provider_request("GET", "https://tasks.googleapis.com/tasks/v1/users/@me/lists", "google", user_integration.id, budget, headers=headers)
     
     if res.status_code == status.HTTP_401_UNAUTHORIZED:
-        token_data = google_utils.refresh_google_access_token(user_integration, db, "google_tasks")
-        access_token = token_data["access_token"]
+        access_token = token_manager.get_access_token(user_integration, db, rejected_token=access_token)
         headers["Authorization"] = f"Bearer {access_token}"
-        res = requests.get("https://tasks.googleapis.com/tasks/v1/users/@me/lists", headers=headers)
+        res = http_client.provider_request("GET", "https://tasks.googleapis.com/tasks/v1/users/@me/lists", "google", user_integration.id, budget, headers=headers)
 
-    if res.status_code != status.HTTP_200_OK:
-        raise Exception(f"Failed to fetch task lists: {res.json()}")
-    
-    lists = res.json().get("items", [])
+    lists = http_client.provider_json(res, "google", "fetch task lists").get("items", [])
+    upserter = sync_utils.TaskUpserter(db, user.id, "Google Tasks")
+    cursor = sync_utils.get_sync_cursor(user_integration, full_sync)
     
     for tasklist in lists:
         
@@ -83,17 +83,23 @@ def sync_user_google_tasks(user_id: int, db: Session = Depends(get_db)):
 
         page_token = None
         while True:
-            params = {"maxResults": 250}
+            # completed tasks are hidden by default, showHidden keeps completions in the delta and showDeleted its deletions
+            params = {"maxResults": 250, "showHidden": "true", "showDeleted": "true"}
+            if cursor:
+                params["updatedMin"] = sync_utils.format_rfc3339(cursor)
             if page_token:
                 params["pageToken"] = page_token
 
-            res_tasks = requests.get(f"https://tasks.googleapis.com/tasks/v1/lists/{list_id}/tasks", headers=headers, params=params)
-            tasks = res_tasks.json().get("items", [])
+            res_tasks = http_client.provider_request("GET", f"https://tasks.googleapis.com/tasks/v1/lists/{list_id}/tasks", "google", user_integration.id, budget, headers=headers, params=params)
+            tasks_data = http_client.provider_json(res_tasks, "google", "fetch tasks")
+            tasks = tasks_data.get("items", [])
 
             for t in tasks:
-                task_in_db = db.query(models.Task).filter(models.Task.integration_provider_task_id == t["id"], models.Task.user_id == user.id).first()
-                
-                task_data = {
+                if t.get("deleted"):
+                    upserter.remove(t["id"])
+                    continue
+
+                upserter.add({
                     "title"             : t.get("title", "Untitled"),
                     "description"       : t.get("notes", ""),
                     "deadline"          : t.get("due", datetime.utcnow()),
@@ -105,22 +111,13 @@ def sync_user_google_tasks(user_id: int, db: Session = Depends(get_db)):
                     "source"            : "Google Tasks",
                     "updated_at"        : t.get("updated"),
                     "integration_provider_task_id"    : t["id"],
-                }
-
-                if task_in_db:
-                    if task_in_db.updated_at != t.get("updated"):
-                        for key, value in task_data.items():
-                            setattr(task_in_db, key, value)
-                        db.commit()
-                else:
-                    # create new task
-                    new_task = models.Task(**task_data, user_id=user.id)
-                    db.add(new_task)
-                    db.commit()
-
-            page_token = res_tasks.json().get("nextPageToken")
+                })
+
+            page_token = tasks_data.get("nextPageToken")
             if not page_token:
                 break
+    
+    sync_utils.advance_sync_cursor(user_integration, started_at)
+    upserter.commit()
             
-    return {"message", "Google tasks synced successfully."}
-
+    return {"message": "Google tasks synced successfully."}
\ No newline at end of file
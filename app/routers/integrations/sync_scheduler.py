@@ -0,0 +1,143 @@
+import heapq
+import queue
+import random
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import or_, select, update
+
+from app import models
+from app.database import SessionLocal
+
+
+# claimed but not yet running integrations per worker thread: a tick only claims what the pool can start soon,
+# so claims don't expire while still waiting in the queue
+QUEUE_DEPTH_PER_WORKER = 4
+
+
+class SyncScheduler:
+    """
+    Keeps every connected integration fresh without any client triggering a sync.
+    Each tick claims the integrations that are due (most stale first, no more than the pool can start soon) by pushing
+    their `next_sync_at` forward, so every app worker can run a scheduler without two of them syncing the same
+    integration; a claim is renewed when its sync starts and dropped if another scheduler took it over meanwhile;
+    a fixed pool of worker threads drains the claimed ones and per-provider limits cap how many syncs hit one provider at once.
+    """
+
+    def __init__(self, run_sync, provider_concurrency: dict[str, int], interval_minutes=15, jitter_seconds=120, worker_pool_size=8, batch_size=500):
+        self.run_sync = run_sync
+        self.provider_concurrency = provider_concurrency
+        self.interval_minutes = interval_minutes
+        self.jitter_seconds = jitter_seconds
+        self.worker_pool_size = worker_pool_size
+        self.batch_size = batch_size
+
+        self.queue = queue.PriorityQueue()
+        self.lock = threading.Lock()
+        self.running = {service: 0 for service in provider_concurrency}
+        self.deferred = {service: [] for service in provider_concurrency}
+        self.workers: list[threading.Thread] = []
+
+
+    def start(self):
+        if self.workers:
+            return
+
+        for i in range(self.worker_pool_size):
+            worker = threading.Thread(target=self._work, name=f"sync-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+
+    def tick(self):
+        self.start()
+        now = datetime.utcnow()
+        interval = timedelta(minutes=self.interval_minutes)
+
+        with self.lock:
+            waiting = self.queue.qsize() + sum(len(items) for items in self.deferred.values())
+        capacity = min(self.batch_size, self.worker_pool_size * QUEUE_DEPTH_PER_WORKER - waiting)
+        if capacity <= 0:
+            return
+
+        # queued, running and backed-off integrations all have `next_sync_at` in the future, so they never take a
+        # place in the batch; SKIP LOCKED lets the schedulers of other workers claim the rest of the due ones meanwhile
+        due = select(models.Integration.id).where(
+            models.Integration.service.in_(list(self.provider_concurrency)),
+            or_(models.Integration.last_synced_at.is_(None), models.Integration.last_synced_at < now - interval),
+            or_(models.Integration.next_sync_at.is_(None), models.Integration.next_sync_at <= now),
+        ).order_by(models.Integration.last_synced_at.asc().nulls_first()).limit(capacity).with_for_update(skip_locked=True)
+
+        db = SessionLocal()
+        try:
+            # a claim expires after one interval, in case the worker holding it dies
+            claimed = db.execute(update(models.Integration).where(models.Integration.id.in_(due.scalar_subquery())).values(
+                next_sync_at=now + interval,
+            ).returning(models.Integration.id, models.Integration.user_id, models.Integration.service, models.Integration.last_synced_at, models.Integration.next_sync_at)).all()
+            db.commit()
+        finally:
+            db.close()
+
+        for integration_id, user_id, service, last_synced_at, claimed_until in claimed:
+            # never synced integrations first, then the most stale ones
+            self.queue.put((last_synced_at or datetime.min, integration_id, user_id, service, claimed_until))
+
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            _, integration_id, user_id, service, claimed_until = item
+
+            with self.lock:
+                if self.running[service] >= self.provider_concurrency[service]:
+                    # provider at its limit: park the item until one of its syncs finishes
+                    heapq.heappush(self.deferred[service], item)
+                    continue
+                self.running[service] += 1
+
+            try:
+                # a claim that expired while waiting may have been taken by another scheduler meanwhile
+                if self._renew_claim(integration_id, claimed_until):
+                    try:
+                        result = self.run_sync(service, user_id)
+                    except Exception as e:
+                        result = {"status": "failed", "detail": str(e)}
+                    self._schedule_next(integration_id, result.get("status") == "ok")
+            except Exception as e:
+                # the claim expires on its own, the integration is retried after one interval
+                print(f"Failed to schedule the next sync of integration {integration_id}: {e}")
+
+            with self.lock:
+                self.running[service] -= 1
+                if self.deferred[service]:
+                    self.queue.put(heapq.heappop(self.deferred[service]))
+
+
+    def _renew_claim(self, integration_id: int, claimed_until: datetime) -> bool:
+        db = SessionLocal()
+        try:
+            # still ours only if nobody moved `next_sync_at` since the tick claimed it
+            renewed = db.execute(update(models.Integration).where(
+                models.Integration.id == integration_id,
+                models.Integration.next_sync_at == claimed_until,
+            ).values(next_sync_at=datetime.utcnow() + timedelta(minutes=self.interval_minutes)).returning(models.Integration.id)).first()
+            db.commit()
+        finally:
+            db.close()
+
+        return renewed is not None
+
+
+    def _schedule_next(self, integration_id: int, succeeded: bool):
+        # failed syncs don't advance `last_synced_at`, they wait a full interval before retrying;
+        # jitter spreads integrations that were synced together over the following ticks
+        delay = timedelta(minutes=self.interval_minutes)
+        if succeeded:
+            delay += timedelta(seconds=random.uniform(0, self.jitter_seconds))
+
+        db = SessionLocal()
+        try:
+            # deleted integrations simply match no row
+            db.execute(update(models.Integration).where(models.Integration.id == integration_id).values(next_sync_at=datetime.utcnow() + delay))
+            db.commit()
+        finally:
+            db.close()
@@ -1,50 +1,97 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi_utils.tasks import repeat_every
+import asyncio, time
 
-from app import models
-from app.database import get_db
+from app import models, schemas
+from app.config import settings
+from app.database import SessionLocal
 from app.oauth2 import get_current_user
 from app.routers.integrations import google_classroom, google_tasks, trello_cards, zoom_meetings
+from app.routers.integrations.sync_scheduler import SyncScheduler
 
 router = APIRouter(prefix="/api/integrations", tags=["Sync User Tasks"])
 
+
+PROVIDER_SYNCS = {
+    "google_tasks"      : google_tasks.sync_user_google_tasks,
+    "google_classroom"  : google_classroom.sync_user_google_classroom,
+    "trello_cards"      : trello_cards.sync_user_trello_cards,
+    "zoom_meetings"     : zoom_meetings.sync_user_zoom_meetings,
+}
+
+
+@router.on_event("startup")
+@repeat_every(seconds=settings.sync_scheduler_tick_seconds)
+def schedule_due_syncs():
+    if settings.sync_scheduler_enabled:
+        scheduler.tick()
+
+
 @router.get("/sync")
-async def sync_user(db: Session=Depends(get_db)):
-    
-    user_id = 1
-    user_integrations = db.query(models.Integration).filter(models.Integration.user_id == user_id).all() 
-    
-    for integration in user_integrations:
-        
-        match integration.service:
-            case "google_tasks":
-                google_tasks.sync_user_google_tasks(user_id, db)
-                
-            case "google_classroom":
-                google_classroom.sync_user_google_classroom(user_id, db)
-            
-            case "trello_cards":
-                trello_cards.sync_user_trello_cards(user_id, db)
-                
-            case "zoom_meetings":
-                zoom_meetings.sync_user_zoom_meetings(user_id, db)
-                
-        
-    # user = db.query(models.User).filter(models.User.id == user_id).first()
-    # for integration in user_integrations:
-        
-    #     match integration.service:
-    #         case "google_tasks":
-    #             google_tasks.sync_user_google_tasks(user, db)
-                
-    #         case "google_classroom":
-    #             google_classroom.sync_user_google_classroom(user, db)
-            
-    #         case "trello_cards":
-    #             trello_cards.sync_user_trello_cards(user, db)
-                
-    #         case "zoom_meetings":
-    #             zoom_meetings.sync_user_zoom_meetings(user, db)
-                
-    
-    return {"message" : "Succefully synced user tasks."}
\ No newline at end of file
+async def sync_user(current_user: schemas.Principal = Depends(get_current_user)):
+    
+    providers = await sync_user_integrations(current_user.id)
+    
+    return {"message" : "Succefully synced user tasks.", "providers": providers}
+
+
+async def sync_user_integrations(user_id: int) -> dict[str, dict]:
+    """
+    Run every connected provider sync of a user concurrently (bounded by `sync_max_concurrent_providers`).
+    Each provider runs in a worker thread with its own DB session, so a slow or failing provider
+    neither blocks the event loop nor the other providers.
+    """
+    services = await asyncio.to_thread(_load_user_services, user_id)
+    semaphore = asyncio.Semaphore(settings.sync_max_concurrent_providers)
+
+    async def run(service: str):
+        async with semaphore:
+            return await asyncio.to_thread(run_provider_sync, service, user_id)
+
+    results = await asyncio.gather(*(run(service) for service in services))
+    
+    return dict(zip(services, results))
+
+
+def run_provider_sync(service: str, user_id: int) -> dict:
+    db = SessionLocal()
+    started = time.perf_counter()
+    
+    try:
+        PROVIDER_SYNCS[service](user_id, db=db)
+        result = {"status": "ok"}
+    
+    except HTTPException as e:
+        db.rollback()
+        result = {"status": "failed", "detail": e.detail}
+    
+    except Exception as e:
+        db.rollback()
+        result = {"status": "failed", "detail": str(e)}
+    
+    finally:
+        db.close()
+
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"Sync {service} for user {user_id}: {result['status']} in {result['duration_ms']} ms")
+    
+    return result
+
+
+def _load_user_services(user_id: int) -> list[str]:
+    db = SessionLocal()
+    try:
+        rows = db.query(models.Integration.service).filter(models.Integration.user_id == user_id).distinct().all()
+    finally:
+        db.close()
+
+    return [service for (service,) in rows if service in PROVIDER_SYNCS]
+
+
+scheduler = SyncScheduler(
+    run_provider_sync,
+    provider_concurrency={service: settings.sync_provider_concurrency.get(service, 1) for service in PROVIDER_SYNCS},
+    interval_minutes=settings.sync_interval_minutes,
+    jitter_seconds=settings.sync_jitter_seconds,
+    worker_pool_size=settings.sync_worker_pool_size,
+)
@@ -3,12 +3,12 @@ from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from datetime import datetime, timezone
 from urllib.parse import unquote, quote
-import json, requests, time
+import json, time
 
 from app.config import settings
 from app import models
 from app.database import get_db
-from app.utils import crypt_utils
+from app.utils import crypt_utils, http_client, sync_utils, token_manager
 from app.oauth2 import get_current_user
 from fastapi_utils.tasks import repeat_every
 from app.database import get_db
@@ -47,9 +47,9 @@ def auth_trello_cards(current_user_id: int = 1, db: Session = Depends(get_db)):
     callback_url = settings.trello_redirect_uri() # e.g., "https://<ngrok>.ngrok.io/api/integrations/trello/callback/cards"
 
     # request a temporary token from Trello
-    oauth = OAuth1Session(client_key=settings.trello_api_key, client_secret=settings.trello_client_secret, callback_uri=callback_url)
+    oauth = trello_oauth_session(client_key=settings.trello_api_key, client_secret=settings.trello_client_secret, callback_uri=callback_url)
     try:
-        fetch_response = oauth.fetch_request_token("https://trello.com/1/OAuthGetRequestToken")
+        fetch_response = oauth.fetch_request_token("https://trello.com/1/OAuthGetRequestToken", timeout=http_client.DEFAULT_TIMEOUT)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to obtain request token: {e}")
 
@@ -94,7 +94,7 @@ def trello_callback(request: Request, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Unknown or expired request token")
 
     # exchange request token + verifier for access token
-    oauth = OAuth1Session(
+    oauth = trello_oauth_session(
         client_key=settings.trello_api_key,
         client_secret=settings.trello_client_secret,
         resource_owner_key=temp.oauth_token,
@@ -102,7 +102,7 @@ def trello_callback(request: Request, db: Session = Depends(get_db)):
         verifier=oauth_verifier
                             )
     try:
-        access_resp = oauth.fetch_access_token("https://trello.com/1/OAuthGetAccessToken")
+        access_resp = oauth.fetch_access_token("https://trello.com/1/OAuthGetAccessToken", timeout=http_client.DEFAULT_TIMEOUT)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch access token: {e}")
 
@@ -124,10 +124,13 @@ def trello_callback(request: Request, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="User not found")
 
     # remove any existing trello integration for this user if you want single integration
-    db.query(models.Integration).filter(
+    old_integrations = db.query(models.Integration).filter(
         models.Integration.user_id == user.id,
         models.Integration.service == "trello_cards"
-    ).delete(synchronize_session=False)
+    )
+    for (old_integration_id,) in old_integrations.with_entities(models.Integration.id):
+        crypt_utils.invalidate_credentials(old_integration_id)
+    old_integrations.delete(synchronize_session=False)
 
     integration = models.Integration(
         user_id=user.id,
@@ -150,8 +153,9 @@ def trello_callback(request: Request, db: Session = Depends(get_db)):
 # @router.get("/cards/sync")
 # def sync_user_trello_cards(user_id: int = Depends(get_current_user), db: Session = Depends(get_db)):
 @router.get("/cards/{user_id}/sync")
-def sync_user_trello_cards(user_id: int, db: Session = Depends(get_db)):
+def sync_user_trello_cards(user_id: int, full_sync: bool = False, db: Session = Depends(get_db)):
 
+    started_at = datetime.now(timezone.utc)
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
@@ -160,20 +164,30 @@ def sync_user_trello_cards(user_id: int, db: Session = Depends(get_db)):
     if not user_integration:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not connected to Trello")
 
-    access_token = crypt_utils.decrypt(user_integration.access_token)
+    access_token = token_manager.get_access_token(user_integration, db)
     key = settings.trello_api_key
     headers = {"Accept": "application/json"}
+    budget = http_client.RetryBudget()
 
-    res_boards = requests.get(f"https://api.trello.com/1/members/me/boards?key={key}&token={access_token}", headers=headers)
-    boards = res_boards.json()
+    res_boards = http_client.provider_request("GET", f"https://api.trello.com/1/members/me/boards?fields=id,dateLastActivity&key={key}&token={access_token}", "trello", user_integration.id, budget, headers=headers)
+    boards = http_client.provider_json(res_boards, "trello", "fetch boards")
+    upserter = sync_utils.TaskUpserter(db, user.id, "Trello")
+    cursor = sync_utils.get_sync_cursor(user_integration, full_sync)
 
     for board in boards:
         board_id = board["id"]
 
-        res_cards = requests.get(f"https://api.trello.com/1/boards/{board_id}/cards?key={key}&token={access_token}",headers=headers)
-        cards = res_cards.json()
+        # a board without activity since the last sync has no changed cards
+        if cursor and not is_active_since(board, cursor):
+            continue
+
+        res_cards = http_client.provider_request("GET", f"https://api.trello.com/1/boards/{board_id}/cards?key={key}&token={access_token}", "trello", user_integration.id, budget, headers=headers)
+        cards = http_client.provider_json(res_cards, "trello", "fetch cards")
 
         for card in cards:
+            if cursor and not is_active_since(card, cursor):
+                continue
+
             due_date = None
             if card.get("due"):
                 due_date = datetime.fromisoformat(card["due"].replace("Z", "+00:00"))
@@ -185,7 +199,7 @@ def sync_user_trello_cards(user_id: int, db: Session = Depends(get_db)):
             else:
                 status_value = "In progress"
 
-            task_data = {
+            upserter.add({
                 "title": card.get("name", "Untitled"),
                 "description": card.get("desc", ""),
                 "deadline": due_date,
@@ -196,20 +210,26 @@ def sync_user_trello_cards(user_id: int, db: Session = Depends(get_db)):
                 # "trello_board_id": board_id,
                 "integration_provider_task_id": card["id"],
                 "updated_at": card.get("dateLastActivity"),
-            }
+            })
 
-            task_in_db = db.query(models.Task).filter(models.Task.integration_provider_task_id == card["id"], models.Task.user_id == user.id).first()
+    # cards skipped by the cursor still turn Overdue once their due date passes
+    upserter.expire_overdue()
+    sync_utils.advance_sync_cursor(user_integration, started_at)
+    upserter.commit()
 
-            if task_in_db:
-                for key, value in task_data.items():
-                    setattr(task_in_db, key, value)
-            else:
-                new_task = models.Task(**task_data, user_id=user.id)
-                db.add(new_task)
+    return {"message": "Trello synced successfully for user"}
 
-        db.commit()
 
-    return {"message": "Trello synced successfully for user"}
+def trello_oauth_session(**kwargs) -> OAuth1Session:
+    # OAuth 1.0a handshakes go through the shared connection pool too
+    oauth = OAuth1Session(**kwargs)
+    oauth.mount("https://", http_client.adapter)
+    return oauth
+
+
+def is_active_since(trello_object: dict, cursor: datetime) -> bool:
+    last_activity = sync_utils.parse_provider_datetime(trello_object.get("dateLastActivity"))
+    return last_activity is None or last_activity >= cursor
 
 
 
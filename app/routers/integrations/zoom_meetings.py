@@ -2,17 +2,20 @@ from fastapi import APIRouter, Request, Depends, HTTPException, status
 from fastapi.responses import RedirectResponse
 from sqlalchemy.orm import Session
 from urllib.parse import quote, unquote
-from datetime import datetime, timedelta
-import requests, json
+from datetime import datetime, timedelta, timezone
+import json
 
 from app import models
 from app.oauth2 import get_current_user
 from app.database import get_db
-from app.utils import crypt_utils 
+from app.utils import crypt_utils, http_client, sync_utils, token_manager
 from app.config import settings 
 
 router = APIRouter(prefix="/api/integrations/zoom", tags=["Zoom Meetings"])
 
+ZOOM_MEETINGS_URL = "https://api.zoom.us/v2/users/me/meetings"
+ZOOM_PAGE_SIZE = 300    # maximum allowed by Zoom
+
 
 
 
@@ -53,6 +56,7 @@ def zoom_meetings_auth_callback(request: Request, db: Session = Depends(get_db))
 @router.get("/meetings/{user_id}/sync")
 def sync_user_zoom_meetings(user_id: int, db: Session = Depends(get_db)):
     
+    started_at = datetime.now(timezone.utc)
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not Found")
@@ -62,62 +66,79 @@ def sync_user_zoom_meetings(user_id: int, db: Session = Depends(get_db)):
     if not integration:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not connected to Zoom")
 
-    access_token = crypt_utils.decrypt(integration.access_token)
-    headers = {"Authorization": f"Bearer {access_token}"}
-
-    url = "https://api.zoom.us/v2/users/me/meetings?type=upcoming"
-
-    res = requests.get(url, headers=headers)
-
-    # refresh token if expired
-    if res.status_code == 401:
-        token_data = refresh_zoom_access_token(integration, db)
-        access_token = token_data["access_token"]
-        headers["Authorization"] = f"Bearer {access_token}"
-        res = requests.get(url, headers=headers)
-
-    if res.status_code != 200:
-        raise HTTPException(500, f"Failed to fetch zoom meetings: {res.json()}")
-
-    meetings = res.json().get("meetings", [])
-
-    for m in meetings:
-        meeting_id = str(m["id"])
-
-        task_in_db = db.query(models.Task).filter(models.Task.integration_provider_task_id == meeting_id, models.Task.user_id == user.id).first()
-
-        meeting_start = m.get("start_time")
-        meeting_topic = m.get("topic", "Zoom Meeting")
-        meeting_status = "Upcoming"
-        meeting_updated_at = m.get("updated_at", datetime.utcnow())
-
-        task_data = {
-            "title": meeting_topic,
-            "description": "Zoom Meeting",
-            "deadline": meeting_start,
-            "status": meeting_status,
-            "category": "Zoom",
-            "priority": "Medium",
-            "source": "Zoom",
-            "updated_at": meeting_updated_at,
-            "integration_provider_task_id": meeting_id
-        }
-
-        if task_in_db:
-            if str(task_in_db.updated_at) != str(meeting_updated_at):
-                for key, value in task_data.items():
-                    setattr(task_in_db, key, value)
-                db.commit()
-        else:
-            new_task = models.Task(**task_data, user_id=user.id)
-            db.add(new_task)
-            db.commit()
+    budget = http_client.RetryBudget()
+    # Zoom has no "changed since" filter and meetings carry no updated_at,
+    # so the upserter only writes meetings whose topic, start time or status differ from the stored task
+    upserter = sync_utils.TaskUpserter(db, user.id, "Zoom", preload=False)
+    # ids only, and only of meetings still scheduled: it doesn't grow with the meeting history
+    upcoming_ids = set()
+
+    for meeting_type in settings.zoom_sync_meeting_types:
+        
+        # every page is written in its own short transaction before the next one is requested,
+        # only one page is held in memory
+        for meetings in iter_zoom_meeting_pages(integration, db, meeting_type, budget):
+            upserter.prefetch(str(m["id"]) for m in meetings)
+            for m in meetings:
+                meeting_id = str(m["id"])
+                
+                # recurring meetings share one id: still upcoming wins over an already held occurrence
+                if meeting_type != "previous_meetings":
+                    upcoming_ids.add(meeting_id)
+                elif meeting_id in upcoming_ids:
+                    continue
+                
+                upserter.add({
+                    "title": m.get("topic", "Zoom Meeting"),
+                    "description": "Zoom Meeting",
+                    "deadline": m.get("start_time"),
+                    "status": "Completed" if meeting_type == "previous_meetings" else "Upcoming",
+                    "category": "Zoom",
+                    "priority": "Medium",
+                    "source": "Zoom",
+                    "updated_at": m.get("updated_at"),
+                    "integration_provider_task_id": meeting_id
+                })
+            upserter.flush()
+
+    sync_utils.advance_sync_cursor(integration, started_at)
+    upserter.commit()
 
     return {"message": "Zoom meetings synced successfully."}
 
 
 
 
+def iter_zoom_meeting_pages(integration: models.Integration, db: Session, meeting_type: str, budget: http_client.RetryBudget):
+    """
+    Yield the user's meetings of one type (upcoming / scheduled / previous_meetings) page by page, following `next_page_token`.
+    Previous meetings are limited to the last `zoom_sync_window_days` days.
+    """
+    params = {"type": meeting_type, "page_size": ZOOM_PAGE_SIZE}
+    if meeting_type == "previous_meetings":
+        today = datetime.utcnow().date()
+        params["from"] = (today - timedelta(days=settings.zoom_sync_window_days)).isoformat()
+        params["to"] = today.isoformat()
+
+    access_token = token_manager.get_access_token(integration, db)
+
+    while True:
+        res = http_client.provider_request("GET", ZOOM_MEETINGS_URL, "zoom", integration.id, budget, headers={"Authorization": f"Bearer {access_token}"}, params=params)
+
+        # refresh token if expired
+        if res.status_code == status.HTTP_401_UNAUTHORIZED:
+            access_token = token_manager.get_access_token(integration, db, rejected_token=access_token)
+            res = http_client.provider_request("GET", ZOOM_MEETINGS_URL, "zoom", integration.id, budget, headers={"Authorization": f"Bearer {access_token}"}, params=params)
+
+        data = http_client.provider_json(res, "zoom", "fetch zoom meetings")
+        yield data.get("meetings", [])
+
+        next_page_token = data.get("next_page_token")
+        if not next_page_token:
+            return
+        params["next_page_token"] = next_page_token
+
+
 def build_zoom_auth_url(user_id: int | None = None) -> str:
     state_data = {}
     if user_id:
@@ -146,7 +167,7 @@ def get_zoom_tokens(code: str) -> dict[str, str]:
         "redirect_uri": settings.zoom_redirect_uri()
     }
 
-    r = requests.post(url, params=params, auth=(settings.zoom_client_id, settings.zoom_client_secret))
+    r = http_client.post(url, params=params, auth=(settings.zoom_client_id, settings.zoom_client_secret))
 
     if r.status_code != status.HTTP_200_OK:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Zoom token exchange failed: {r.text}")
@@ -161,14 +182,18 @@ def get_zoom_tokens(code: str) -> dict[str, str]:
 
 
 def refresh_zoom_access_token(integration: models.Integration, db: Session):
+    """
+    Zoom refresh backend of `token_manager`, call `token_manager.get_access_token` instead.
+    Zoom rotates the refresh token on every refresh, so two concurrent refreshes would invalidate each other.
+    """
     url = "https://zoom.us/oauth/token"
 
     params = {
         "grant_type": "refresh_token",
-        "refresh_token": crypt_utils.decrypt(integration.refresh_token)
+        "refresh_token": crypt_utils.decrypt_credential(integration.id, integration.refresh_token)
     }
 
-    request = requests.post(url, params=params, auth=(settings.zoom_client_id, settings.zoom_client_secret))
+    request = http_client.post(url, params=params, auth=(settings.zoom_client_id, settings.zoom_client_secret))
 
     if request.status_code != status.HTTP_200_OK:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Zoom refresh failed: {request.text}")
@@ -185,10 +210,14 @@ def refresh_zoom_access_token(integration: models.Integration, db: Session):
     db.refresh(integration)
 
     return {
-        "access_token": data["access_token"]
+        "access_token": data["access_token"],
+        "expires_in": data.get("expires_in"),
     }
 
 
+token_manager.register_refresh_backend("zoom_meetings", refresh_zoom_access_token)
+
+
 def handle_zoom_token_save(user: models.User, tokens: dict, db: Session):
     access_token = crypt_utils.encrypt(tokens.get("access_token"))
     
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, status, HTTPException, Response, Depends 
+from fastapi import APIRouter, status, HTTPException, Response, Depends, Query, Request, Header
+from fastapi.responses import StreamingResponse
+from fastapi_utils.tasks import repeat_every
 from sqlalchemy.orm import Session 
-from typing import List 
+from sqlalchemy import insert, update, delete, select
+from typing import List, Literal, Optional
 from datetime import datetime
+import asyncio, json
 
-from app.database import get_db 
+from app.config import settings
+from app.database import get_db, SessionLocal
 from app import schemas, models, oauth2
+from app.utils import task_utils, task_changes, task_events
 
 
 router = APIRouter(
@@ -13,13 +19,31 @@ router = APIRouter(
 )
 
 
+@router.on_event("startup")
+def start_task_events():
+    task_events.broker.start()
+
+
+@router.on_event("startup")
+@repeat_every(seconds=settings.task_tombstone_sweep_seconds)
+def sweep_task_tombstones():
+    db = SessionLocal()
+    try:
+        task_changes.sweep_tombstones(db)
+    finally:
+        db.close()
+
+
 # require authentication (login)
 @router.post("/", response_model=schemas.TaskRead, status_code=status.HTTP_201_CREATED)
-def create_task(task: schemas.TaskCreate, db: Session=Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+def create_task(task: schemas.TaskCreate, db: Session=Depends(get_db), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
     
-    task = models.Task(**task.dict(), user_id=current_user.id, source="sentry")
+    change_seq = task_changes.next_change_seq(db, current_user.id)
+    task = models.Task(**task.dict(), user_id=current_user.id, source="sentry", change_seq=change_seq)
 
     db.add(task)
+    db.flush()
+    task_events.queue_event(db, current_user.id, change_seq, "insert", [task.id])
     db.commit()
     db.refresh(task)
     
@@ -27,17 +51,214 @@ def create_task(task: schemas.TaskCreate, db: Session=Depends(get_db), current_u
 
 
 # require authentication (login)
+# creates, partial updates and deletes of many tasks in one transaction with set-based statements
+@router.post("/batch", response_model=schemas.TaskBatchResult, status_code=status.HTTP_200_OK)
+def batch_tasks(batch: schemas.TaskBatch, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
+    
+    results = []
+    now = datetime.now()
+
+    # ownership of every referenced task in one query
+    referenced_ids = {item.id for item in batch.update} | set(batch.delete)
+    owners = dict(db.query(models.Task.id, models.Task.user_id).filter(models.Task.id.in_(referenced_ids)).all()) if referenced_ids else {}
+
+    def rejected(operation: str, task_id: int) -> schemas.TaskBatchItemResult | None:
+        if task_id not in owners:
+            return schemas.TaskBatchItemResult(operation=operation, id=task_id, status_code=status.HTTP_404_NOT_FOUND, detail=f"task with id: {task_id} is not exist")
+        if owners[task_id] != current_user.id:
+            return schemas.TaskBatchItemResult(operation=operation, id=task_id, status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
+        return None
+
+    updates = []
+    for item in batch.update:
+        error = rejected("update", item.id)
+        if error:
+            results.append(error)
+        else:
+            try:
+                updates.append(task_patch_values(item))
+            except HTTPException as e:
+                results.append(schemas.TaskBatchItemResult(operation="update", id=item.id, status_code=e.status_code, detail=e.detail))
+
+    delete_ids = []
+    for task_id in batch.delete:
+        error = rejected("delete", task_id)
+        if error:
+            results.append(error)
+        else:
+            delete_ids.append(task_id)
+
+    if not (batch.create or updates or delete_ids):
+        return {"results": results}
+
+    change_seq = task_changes.next_change_seq(db, current_user.id)
+
+    if batch.create:
+        rows = [{**task.dict(), "user_id": current_user.id, "source": "sentry", "change_seq": change_seq} for task in batch.create]
+        created = db.scalars(insert(models.Task).returning(models.Task, sort_by_parameter_order=True), rows).all()
+        results += [schemas.TaskBatchItemResult(operation="create", id=task.id, status_code=status.HTTP_201_CREATED, task=schemas.TaskRead.model_validate(task)) for task in created]
+        task_events.queue_event(db, current_user.id, change_seq, "insert", [task.id for task in created])
+
+    if updates:
+        updates = [{**row, "updated_at": now, "change_seq": change_seq} for row in updates]
+        # bulk UPDATE by primary key, rows with the same set of fields share one executemany
+        db.execute(update(models.Task), updates)
+        updated = db.query(models.Task).filter(models.Task.id.in_([row["id"] for row in updates])).populate_existing().all()
+        results += [schemas.TaskBatchItemResult(operation="update", id=task.id, status_code=status.HTTP_200_OK, task=schemas.TaskRead.model_validate(task)) for task in updated]
+        task_events.queue_event(db, current_user.id, change_seq, "update", [task.id for task in updated])
+
+    if delete_ids:
+        deleted = db.execute(delete(models.Task).where(models.Task.id.in_(delete_ids), models.Task.user_id == current_user.id).returning(models.Task.id, models.Task.integration_provider_task_id)).all()
+        task_changes.record_deletions(db, current_user.id, change_seq, deleted)
+        results += [schemas.TaskBatchItemResult(operation="delete", id=task_id, status_code=status.HTTP_204_NO_CONTENT) for task_id, _ in deleted]
+        task_events.queue_event(db, current_user.id, change_seq, "delete", [task_id for task_id, _ in deleted])
+
+    db.commit()
+
+    return {"results": results}
+
+
+# require authentication (login)
+# paginated by (deadline, id), the next page cursor is sent in the `X-Next-Cursor` header
 @router.get("/", response_model=List[schemas.TaskRead], status_code=status.HTTP_200_OK)
-def get_user_tasks(db: Session=Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+def get_user_tasks(
+    request: Request,
+    response: Response,
+    filters: schemas.TaskFilter = Depends(),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    order: Literal["asc", "desc"] = "asc",
+    if_none_match: Optional[str] = Header(None),
+    db: Session=Depends(get_db),
+    current_user: schemas.Principal = Depends(oauth2.get_current_user)):
 
-    tasks = db.query(models.Task).filter(models.Task.user_id == current_user.id).all()
+    # unchanged since the client's copy: answer from the user's task version without touching any task row
+    version = task_changes.get_tasks_version(db, current_user.id)
+    etag = task_changes.task_etag(current_user.id, version, str(request.url.query))
+    if task_changes.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    descending = order == "desc"
+    query = task_utils.filter_tasks(db.query(models.Task), current_user.id, filters)
+    if cursor:
+        query = task_utils.after_cursor(query, cursor, descending)
+
+    tasks = task_utils.order_tasks(query, descending).limit(limit + 1).all()
+
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        response.headers["X-Next-Cursor"] = task_utils.encode_cursor(tasks[-1])
 
     return tasks 
 
 
+# require authentication (login)
+# tasks written and deleted since the `since` cursor of the previous call, no cursor returns every task
+@router.get("/changes", response_model=schemas.TaskChanges, status_code=status.HTTP_200_OK)
+def get_task_changes(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: schemas.Principal = Depends(oauth2.get_current_user)):
+
+    return task_changes.get_changes(db, current_user.id, since, limit)
+
+
+# require authentication (login), the token may also be passed as `?access_token=`
+# Server-Sent Events stream of the user's task inserts, updates and deletes; on reconnect catch up with /changes
+@router.get("/events")
+async def stream_task_events(request: Request, current_user: schemas.Principal = Depends(oauth2.get_current_stream_user)):
+    
+    user_id = current_user.id
+
+    async def events():
+        queue = task_events.broker.subscribe(user_id)
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    task_event = await asyncio.wait_for(queue.get(), timeout=settings.task_events_heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing an idle stream
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"id: {task_event['change_seq']}\nevent: {task_event['type']}\ndata: {json.dumps(task_event)}\n\n"
+        finally:
+            task_events.broker.unsubscribe(user_id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# require authentication (login)
+# full-text search over titles and descriptions, best matches first; next page cursor in `X-Next-Cursor`
+@router.get("/search", response_model=List[schemas.TaskRead], status_code=status.HTTP_200_OK)
+def search_tasks(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=256),
+    filters: schemas.TaskFilter = Depends(),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user: schemas.Principal = Depends(oauth2.get_current_user)):
+
+    query = task_utils.filter_tasks(db.query(models.Task), current_user.id, filters)
+    query, rank = task_utils.search_tasks(query, q, cursor)
+
+    rows = query.add_columns(rank).limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_task, last_rank = rows[-1]
+        response.headers["X-Next-Cursor"] = task_utils.encode_search_cursor(last_rank, last_task.id)
+
+    return [task for task, _ in rows]
+
+
+# require authentication (login)
+# dashboard counts, served from a per-user cache until the user's tasks change
+@router.get("/stats", response_model=schemas.TaskStats, status_code=status.HTTP_200_OK)
+def get_task_stats(db: Session = Depends(get_db), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
+    
+    return task_utils.get_task_stats(db, current_user.id)
+
+
+# require authentication (login)
+# every task matching the list filters, streamed from a server-side cursor
+@router.get("/export")
+def export_tasks(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    filters: schemas.TaskFilter = Depends(),
+    current_user: schemas.Principal = Depends(oauth2.get_current_user)):
+    
+    user_id = current_user.id
+
+    def rows():
+        # own session: the request's one is closed before the response body is streamed
+        db = SessionLocal()
+        try:
+            query = task_utils.filter_tasks(db.query(models.Task), user_id, filters)
+            if format == "csv":
+                yield task_utils.to_csv([], header=True)
+            for partition in task_utils.export_rows(query):
+                yield task_utils.to_csv(partition) if format == "csv" else task_utils.to_ndjson(partition)
+        finally:
+            db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"tasks.{format}"
+    return StreamingResponse(rows(), media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
 # require authentication (login)
 @router.get("/{task_id}", response_model=schemas.TaskRead, status_code=status.HTTP_200_OK)
-def get_task(task_id: int, db: Session=Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+def get_task(task_id: int, response: Response, if_none_match: Optional[str] = Header(None), db: Session=Depends(get_db), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
+    
+    version = task_changes.get_tasks_version(db, current_user.id)
+    etag = task_changes.task_etag(current_user.id, version, f"task:{task_id}")
+    if task_changes.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     
     task = db.query(models.Task).filter(models.Task.id == task_id).first()
 
@@ -52,40 +273,91 @@ def get_task(task_id: int, db: Session=Depends(get_db), current_user: models.Use
 
 # require authentication (login)
 @router.put("/{task_id}", response_model=schemas.TaskRead, status_code=status.HTTP_200_OK)
-def edit_task(task_id: int, updated_task: schemas.TaskCreate, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+def edit_task(task_id: int, updated_task: schemas.TaskCreate, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
 
-    task_query = db.query(models.Task).filter(models.Task.id == task_id)
-    task = task_query.first()
-    
-    if task == None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"task with id: {task_id} is not exist")
-    
-    if task.user_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
-    
-    updated_task.updated_at = datetime.now()
-    task_query.update(updated_task.dict(), synchronize_session=False)
-    db.commit()
-    
-    return task_query.first()
+    return update_owned_task(db, task_id, current_user.id, updated_task.dict(exclude={"updated_at"}))
+
+
+# require authentication (login), only the fields sent are changed and an explicit null clears a field
+@router.patch("/{task_id}", response_model=schemas.TaskRead, status_code=status.HTTP_200_OK)
+def patch_task(task_id: int, updated_task: schemas.TaskUpdate, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
+
+    return update_owned_task(db, task_id, current_user.id, task_patch_values(updated_task))
 
 
 # require authentication (login)
 @router.delete("/{task_id}", response_model=schemas.TaskRead)
-def remove_task(task_id, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+def remove_task(task_id: int, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
     
-    task_query = db.query(models.Task).filter(models.Task.id == task_id)
-    task = task_query.first()
-    
-    if task == None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"task with id: {task_id} is not exist")
-    
-    if task.user_id != current_user.id:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
+    # version bump, delete and tombstone in one statement, ownership is part of the WHERE clause
+    change_seq = task_changes.next_change_seq_cte(current_user.id)
+    deleted_task = delete(models.Task).where(
+        models.Task.id == task_id,
+        models.Task.user_id == select(change_seq.c.id).scalar_subquery(),
+    ).returning(models.Task.id, models.Task.user_id, models.Task.integration_provider_task_id).cte("deleted_task")
+
+    tombstone = db.execute(
+        insert(models.TaskTombstone).from_select(
+            ["user_id", "task_id", "integration_provider_task_id", "change_seq"],
+            select(deleted_task.c.user_id, deleted_task.c.id, deleted_task.c.integration_provider_task_id, change_seq.c.tasks_version),
+        ).returning(models.TaskTombstone.task_id, models.TaskTombstone.change_seq)
+    ).first()
+
+    if tombstone is None:
+        db.rollback()
+        raise_task_not_writable(db, task_id)
     
-    task_query.delete(synchronize_session=False)
+    task_events.queue_event(db, current_user.id, tombstone.change_seq, "delete", [tombstone.task_id])
     db.commit()
     
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 
+def update_owned_task(db: Session, task_id: int, user_id: int, values: dict) -> schemas.TaskRead:
+    """
+    Version bump and task update in one UPDATE ... RETURNING statement, ownership is part of the WHERE clause.
+    """
+    change_seq = task_changes.next_change_seq_cte(user_id)
+    task = db.scalars(
+        update(models.Task).where(
+            models.Task.id == task_id,
+            models.Task.user_id == select(change_seq.c.id).scalar_subquery(),
+        ).values(**values, updated_at=datetime.now(), change_seq=select(change_seq.c.tasks_version).scalar_subquery()).returning(models.Task),
+        execution_options={"synchronize_session": False},
+    ).first()
+
+    if task is None:
+        db.rollback()
+        raise_task_not_writable(db, task_id)
+
+    # serialized before commit, reading the expired instance afterwards would cost another SELECT
+    result = schemas.TaskRead.model_validate(task)
+    task_events.queue_event(db, user_id, task.change_seq, "update", [task.id])
+    db.commit()
+
+    return result
+
+
+# fields that can't be cleared by a PATCH
+TASK_REQUIRED_FIELDS = ("title", "category", "status", "priority")
+
+
+def task_patch_values(task: schemas.TaskUpdate) -> dict:
+    values = task.dict(exclude_unset=True)
+
+    cleared_required = [field for field in TASK_REQUIRED_FIELDS if field in values and values[field] is None]
+    if cleared_required:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"{', '.join(cleared_required)} can't be null")
+
+    # the description column is not nullable, clearing it stores an empty one
+    if "description" in values and values["description"] is None:
+        values["description"] = ""
+
+    return values
+
+
+def raise_task_not_writable(db: Session, task_id: int):
+    # only reached when the write matched nothing: tell a missing task from someone else's
+    if db.query(models.Task.id).filter(models.Task.id == task_id).first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"task with id: {task_id} is not exist")
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to perform requested action")
@@ -2,7 +2,7 @@ from fastapi import APIRouter, UploadFile, File, HTTPException, status, Depends
 from fastapi_utils.tasks import repeat_every
 
 from app.routers.uploads.session_system import SessionSystem
-from app import models, oauth2
+from app import models, oauth2, schemas
 from app.config import settings 
 
 router = APIRouter(
@@ -16,11 +16,11 @@ UPLOAD_SESSION_EXPIRE_MINUTES = settings.upload_session_expire_minutes
 session_sys = SessionSystem(UPLOAD_FILES_DIR, UPLOAD_SESSION_EXPIRE_MINUTES)
 
 @router.post("/")
-async def upload(file: UploadFile = File(...), current_user: models.User = Depends(oauth2.get_current_user)):
+async def upload(file: UploadFile = File(...), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
     return await session_sys.create_session(file, current_user)
 
 @router.get("/sessions/{session_id}")
-async def get_session(session_id: str, current_user: models.User = Depends(oauth2.get_current_user)):
+async def get_session(session_id: str, current_user: schemas.Principal = Depends(oauth2.get_current_user)):
     session = session_sys.get_session(session_id, current_user)
     if not session:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Session not found or expired")
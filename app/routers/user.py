@@ -55,21 +55,23 @@ def get_user(user_id: int, db: Session=Depends(get_db)):
 
 # require authentication (login)
 @router.put("/", response_model=schemas.UserRead, status_code=status.HTTP_200_OK)
-def edit_user(updated_user: schemas.UserCreate, db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+def edit_user(updated_user: schemas.UserCreate, db: Session = Depends(get_db), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
     
     user_query = db.query(models.User).filter(models.User.id == current_user.id)
     user_query.update(updated_user.dict(), synchronize_session=False)
     db.commit()
+    oauth2.invalidate_principal(current_user.id)
     
     return user_query.first()
 
 
 # require authentication (login)
 @router.delete("/", response_model=schemas.TaskRead)
-def delete_user(db: Session = Depends(get_db), current_user: models.User = Depends(oauth2.get_current_user)):
+def delete_user(db: Session = Depends(get_db), current_user: schemas.Principal = Depends(oauth2.get_current_user)):
     
     user_query = db.query(models.User).filter(models.User.id == current_user.id)    
     user_query.delete(synchronize_session=False)
     db.commit()
+    oauth2.invalidate_principal(current_user.id)
     
     return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,7 +1,9 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import Optional, List, Dict
 from datetime import datetime, date
 
+from app.models import TaskStatus, TaskPriority, TaskCategory, TaskSource
+
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -23,11 +25,11 @@ class UserRead(BaseModel):
 
 class TaskCreate(BaseModel):
     title: str 
-    category: str       # [Development - Study - Meeting - Assignment - Work - Research - Personal]
+    category: TaskCategory
     description: Optional[str] = ""
     
-    status: str         # [In progress (pending) - Completed - failed]
-    priority: str       # [Low - Medium - High]
+    status: TaskStatus
+    priority: TaskPriority
     deadline: datetime 
     updated_at: Optional[datetime] = None
 
@@ -37,13 +39,13 @@ class TaskRead(BaseModel):
     user_id: int
     
     title: str 
-    category: str 
+    category: TaskCategory
     description: str 
     
-    status: str     
-    priority: str
-    deadline: datetime
-    source: str
+    status: TaskStatus
+    priority: TaskPriority
+    deadline: Optional[datetime] = None   # provider tasks (e.g. Trello cards) may have no deadline
+    source: TaskSource
     
     google_task_id: Optional[str] = None
     google_tasklist_id: Optional[str] = None
@@ -53,6 +55,72 @@ class TaskRead(BaseModel):
         from_attributes = True
 
 
+class TaskUpdate(BaseModel):
+    title: Optional[str] = None
+    category: Optional[TaskCategory] = None
+    description: Optional[str] = None
+    
+    status: Optional[TaskStatus] = None
+    priority: Optional[TaskPriority] = None
+    deadline: Optional[datetime] = None
+
+
+class TaskBatchUpdate(TaskUpdate):
+    id: int
+
+
+class TaskBatch(BaseModel):
+    create: List[TaskCreate] = Field(default_factory=list, max_length=500)
+    update: List[TaskBatchUpdate] = Field(default_factory=list, max_length=500)
+    delete: List[int] = Field(default_factory=list, max_length=500)
+
+
+class TaskBatchItemResult(BaseModel):
+    operation: str      # create / update / delete
+    id: Optional[int] = None
+    status_code: int
+    detail: Optional[str] = None
+    task: Optional[TaskRead] = None
+
+
+class TaskBatchResult(BaseModel):
+    results: List[TaskBatchItemResult]
+
+
+class TaskTombstoneRead(BaseModel):
+    task_id: int
+    integration_provider_task_id: Optional[str] = None
+    deleted_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class TaskChanges(BaseModel):
+    changed: List[TaskRead]
+    deleted: List[TaskTombstoneRead]
+    cursor: str         # pass back as `since` for the next call
+    has_more: bool
+
+
+class TaskStats(BaseModel):
+    total: int
+    overdue: int
+    by_status: Dict[str, int]
+    by_priority: Dict[str, int]
+    by_category: Dict[str, int]
+    by_source: Dict[str, int]
+
+
+class TaskFilter(BaseModel):
+    status: Optional[TaskStatus] = None
+    source: Optional[TaskSource] = None
+    category: Optional[TaskCategory] = None
+    priority: Optional[TaskPriority] = None
+    deadline_from: Optional[datetime] = None
+    deadline_to: Optional[datetime] = None
+
+
 class Token(BaseModel):
     access_token: str
     refresh_token: str
@@ -61,4 +129,14 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     id: Optional[str] = None
+    jti: Optional[str] = None
+    issued_at: Optional[int] = None
+    expires_at: Optional[int] = None
+
+
+class Principal(BaseModel):
+    # what authenticated routes get as `current_user`, cached per process by oauth2.get_current_user
+    id: int
+    is_verified: bool
+    tokens_invalid_before: Optional[datetime] = None
     
\ No newline at end of file
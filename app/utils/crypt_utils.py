@@ -1,15 +1,28 @@
 from passlib.context import CryptContext
 from cryptography.fernet import Fernet
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+import hashlib, threading
+
 from app.config import settings 
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto", bcrypt__default_rounds=settings.password_hash_rounds, bcrypt__min_rounds=settings.password_hash_rounds)
+
+# bcrypt is ~100-300 ms of CPU (the GIL is released meanwhile); a pool sized to the cores queues a login burst
+# instead of letting it take every request thread
+password_hash_pool = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix="password-hash")
 
 def hash(password: str):
-    return pwd_context.hash(password)
+    return password_hash_pool.submit(pwd_context.hash, password).result()
 
 
 def verify(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hash_pool.submit(pwd_context.verify, plain_password, hashed_password).result()
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    # cheap, only parses the hash
+    return pwd_context.needs_update(hashed_password)
 
 
 
@@ -21,3 +34,36 @@ def encrypt(token: str) -> str:
 
 def decrypt(token: str) -> str:
     return fernet.decrypt(token.encode()).decode()
+
+
+
+# decrypted integration credentials, in process memory only (never persisted)
+# keyed by (integration id, sha256 of the ciphertext) so a rotated token can never be served from a stale entry;
+# the TTL slides (every hit re-inserts the entry), so a credential used every sync interval never expires
+credential_cache_ttl = settings.credential_cache_ttl_seconds or 2 * settings.sync_interval_minutes * 60 + settings.sync_jitter_seconds
+credential_cache = TTLCache(maxsize=settings.credential_cache_size, ttl=credential_cache_ttl)
+credential_cache_stats = {"hits": 0, "misses": 0}
+_credential_cache_lock = threading.Lock()
+
+def decrypt_credential(integration_id: int, token: str) -> str:
+    key = (integration_id, hashlib.sha256(token.encode()).digest())
+    
+    with _credential_cache_lock:
+        plaintext = credential_cache.get(key)
+        if plaintext is not None:
+            credential_cache[key] = plaintext
+            credential_cache_stats["hits"] += 1
+            return plaintext
+        credential_cache_stats["misses"] += 1
+
+    plaintext = decrypt(token)
+    
+    with _credential_cache_lock:
+        credential_cache[key] = plaintext
+    
+    return plaintext
+
+def invalidate_credentials(integration_id: int):
+    with _credential_cache_lock:
+        for key in [key for key in credential_cache.keys() if key[0] == integration_id]:
+            credential_cache.pop(key, None)
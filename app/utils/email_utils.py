@@ -3,6 +3,10 @@ from sendgrid.helpers.mail import Mail
 from app.config import settings
 
 
+# one client for the whole process instead of a new client (and connection) per email
+sendgrid_client = SendGridAPIClient(settings.sendgrid_api_key)
+
+
 def _send_email(to_email: str, subject: str, html_content: str):
     """
     Internal helper to send an email using SendGrid.
@@ -15,8 +19,7 @@ def _send_email(to_email: str, subject: str, html_content: str):
     )
 
     try:
-        sg = SendGridAPIClient(settings.sendgrid_api_key)
-        response = sg.send(message)
+        response = sendgrid_client.send(message)
         print(f"Email sent to {to_email}, status code: {response.status_code}")
     except Exception as e:
         print(f"Error sending email to {to_email}: {e}")
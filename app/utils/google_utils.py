@@ -4,20 +4,20 @@ from urllib.parse import quote
 import requests, datetime, json
 
 from app import models
-from app.utils import crypt_utils
+from app.utils import crypt_utils, http_client, token_manager
 from app.config import settings 
 
 
-def get_google_user_info(access_token: str) -> dict:
-    resp = requests.get("https://www.googleapis.com/oauth2/v3/userinfo", headers={"Authorization": f"Bearer {access_token}"})
+async def get_google_user_info(access_token: str) -> dict:
+    resp = await http_client.aget("https://www.googleapis.com/oauth2/v3/userinfo", headers={"Authorization": f"Bearer {access_token}"})
     
     if not resp.ok:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to fetch Google user info")
     return resp.json()
 
 
-def get_google_birthday(access_token: str) -> datetime.date | None:
-    resp = requests.get("https://people.googleapis.com/v1/people/me?personFields=birthdays", headers={"Authorization": f"Bearer {access_token}"})
+async def get_google_birthday(access_token: str) -> datetime.date | None:
+    resp = await http_client.aget("https://people.googleapis.com/v1/people/me?personFields=birthdays", headers={"Authorization": f"Bearer {access_token}"})
     
     if resp.ok:
         data = resp.json()
@@ -55,7 +55,7 @@ def build_google_auth_url(service_type: str, user_id: int | None = None, scopes:
     return auth_url
 
 
-def get_google_tokens(code: str, service_type) -> dict[str, str]:
+async def get_google_tokens(code: str, service_type) -> dict[str, str]:
     
     match service_type:
         case "google_tasks":
@@ -72,7 +72,7 @@ def get_google_tokens(code: str, service_type) -> dict[str, str]:
         "redirect_uri": settings.google_redirect_uri(service_type),
         "grant_type": "authorization_code",
     }
-    resp = requests.post("https://oauth2.googleapis.com/token", data=data)  
+    resp = await http_client.apost("https://oauth2.googleapis.com/token", data=data)  
     if not resp.ok:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Failed to get token from Google")
     return resp.json()
@@ -102,17 +102,18 @@ def handle_token_save(user: models.User, tokens: dict, db: Session, service: str
     db.refresh(new_user_integration)
 
 
-def refresh_google_access_token(user: models.Integration, db: Session, service: str):
+def refresh_google_access_token(integration: models.Integration, db: Session):
     """
-    Refresh Google access token for a specific service (tasks).
+    Refresh Google access token of an integration (tasks / classroom).
     Automatically updates the database with the new token and expiry.
+    Used as the Google refresh backend of `token_manager`, call `token_manager.get_access_token` instead.
     """
+    service = integration.service
     
-    integration = db.query(models.Integration).filter(models.Integration.user_id == user.id , models.Integration.service == service).first()
-    if not integration: 
-        raise HTTPException(status.HTTP_404_NOT_FOUND, f"User not connected to {service}")
+    if not integration.refresh_token: 
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED, f"No refresh token stored for {service}. Please reconnect your account.")
     
-    refresh_token = crypt_utils.decrypt(integration.refresh_token)
+    refresh_token = crypt_utils.decrypt_credential(integration.id, integration.refresh_token)
 
     payload = {
         "client_id": settings.google_client_id,
@@ -122,15 +123,15 @@ def refresh_google_access_token(user: models.Integration, db: Session, service:
     }
 
     try:
-        response = requests.post("https://oauth2.googleapis.com/token", data=payload, timeout=10)
+        response = http_client.post("https://oauth2.googleapis.com/token", data=payload)
     except requests.RequestException as e:
         raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Google token endpoint unreachable: {str(e)}")
 
     if response.status_code != status.HTTP_200_OK:
         if "invalid_grant" in response.text:
-            user_query = db.query(models.Integration).filter(models.Integration.id == user.id, models.Integration.service == service)
-            user_query.delete(synchronize_session=False) 
+            db.query(models.Integration).filter(models.Integration.id == integration.id).delete(synchronize_session=False) 
             db.commit()
+            crypt_utils.invalidate_credentials(integration.id)
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"{service.capitalize()} refresh token revoked. Please reconnect your account.")
 
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to refresh {service} access token: {response.text}")
@@ -145,7 +146,7 @@ def refresh_google_access_token(user: models.Integration, db: Session, service:
     integration.access_token = crypt_utils.encrypt(new_access_token)
     integration.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in)
     db.commit()
-    db.refresh(user)
+    db.refresh(integration)
 
     return {
         "access_token": new_access_token,
@@ -153,4 +154,7 @@ def refresh_google_access_token(user: models.Integration, db: Session, service:
         "token_type": "Bearer",
         "service": service
     }
-    
\ No newline at end of file
+
+
+token_manager.register_refresh_backend("google_tasks", refresh_google_access_token)
+token_manager.register_refresh_backend("google_classroom", refresh_google_access_token)
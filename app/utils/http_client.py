@@ -0,0 +1,223 @@
+from fastapi import HTTPException, status
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from cachetools import TTLCache
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, functools, requests, random, threading, time
+
+from app.config import settings
+
+
+DEFAULT_TIMEOUT = (settings.http_connect_timeout_seconds, settings.http_read_timeout_seconds)
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session shared by every outbound call of the app.
+    Connections are kept alive per host, and every request gets a connect/read timeout unless one is passed.
+    """
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+adapter = HTTPAdapter(pool_connections=settings.http_pool_hosts, pool_maxsize=settings.http_pool_maxsize)
+
+session = PooledSession()
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+# the session is shared between users, never carry a provider cookie from one user's call to another
+session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return session.get(url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return session.post(url, **kwargs)
+
+
+# async callers (OAuth callbacks) run the pooled session on these threads, so the event loop never waits on a socket
+async_executor = ThreadPoolExecutor(max_workers=settings.http_async_workers, thread_name_prefix="http-async")
+
+
+async def aget(url: str, **kwargs) -> requests.Response:
+    return await asyncio.get_running_loop().run_in_executor(async_executor, functools.partial(session.get, url, **kwargs))
+
+
+async def apost(url: str, **kwargs) -> requests.Response:
+    return await asyncio.get_running_loop().run_in_executor(async_executor, functools.partial(session.post, url, **kwargs))
+
+
+def pool_stats() -> dict[str, dict]:
+    """
+    Per-host connection pool statistics, e.g. {"tasks.googleapis.com:443": {"connections_opened": 3, "requests": 412, ...}}.
+    """
+    pools = adapter.poolmanager.pools
+    stats = {}
+
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None:
+            continue
+
+        stats[f"{key.key_host}:{key.key_port}"] = {
+            "connections_opened": pool.num_connections,
+            "requests": pool.num_requests,
+            "idle_connections": pool.pool.qsize() if pool.pool else 0,
+            "max_size": settings.http_pool_maxsize,
+        }
+
+    return stats
+
+
+
+# (requests per second, burst) per provider app and per integration token
+PROVIDER_RATE_LIMITS = {
+    "google": {"app": (100, 100), "token": (10, 20)},
+    "trello": {"app": (30, 300), "token": (10, 100)},     # Trello: 300 req / 10 s per key, 100 req / 10 s per token
+    "zoom":   {"app": (30, 30),   "token": (10, 20)},
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+    def pause(self, seconds: float):
+        # throttled by the provider: every caller sharing this bucket waits too
+        with self.lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RetryBudget:
+    """
+    Retries one sync may spend in total, so a throttled provider slows a sync down instead of stalling it forever.
+    """
+
+    def __init__(self, retries: int = settings.provider_retry_budget):
+        self.remaining = retries
+        self.lock = threading.Lock()
+
+
+    def take(self) -> bool:
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+_buckets = TTLCache(maxsize=settings.provider_bucket_cache_size, ttl=3600)
+_buckets_lock = threading.Lock()
+
+
+def provider_request(method: str, url: str, provider: str, token_key=None, budget: RetryBudget | None = None, **kwargs) -> requests.Response:
+    """
+    Send a provider API request through the per-app and per-token rate limits.
+    429/5xx answers and connection errors are retried with exponential backoff and jitter (honouring `Retry-After`)
+    while `budget` allows; the last response is returned, so callers still see 401s and final errors.
+    """
+    buckets = [_bucket(provider, "app", None)]
+    if token_key is not None:
+        buckets.append(_bucket(provider, "token", token_key))
+
+    attempt = 0
+    while True:
+        for bucket in buckets:
+            bucket.acquire()
+
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            if not _can_retry(attempt, budget):
+                raise HTTPException(status.HTTP_502_BAD_GATEWAY, f"{provider.capitalize()} API unreachable: {e}")
+            delay = _backoff(attempt)
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                return response
+
+            delay = _retry_after(response)
+            if delay is None:
+                delay = _backoff(attempt)
+            elif delay > settings.provider_max_retry_after_seconds:
+                return response
+
+            if not _can_retry(attempt, budget):
+                return response
+
+            if response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+                for bucket in buckets:
+                    bucket.pause(delay)
+
+        print(f"{provider} request retry {attempt + 1} in {delay:.1f}s: {method} {urlsplit(url).path}")
+        time.sleep(delay)
+        attempt += 1
+
+
+def provider_json(response: requests.Response, provider: str, action: str):
+    if not response.ok:
+        raise HTTPException(status.HTTP_502_BAD_GATEWAY, f"Failed to {action} ({provider.capitalize()} API {response.status_code}): {response.text[:500]}")
+    return response.json()
+
+
+def _bucket(provider: str, scope: str, token_key) -> TokenBucket:
+    key = (provider, scope, token_key)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(*PROVIDER_RATE_LIMITS[provider][scope])
+        return bucket
+
+
+def _can_retry(attempt: int, budget: RetryBudget | None) -> bool:
+    return attempt < settings.provider_max_retries and (budget is None or budget.take())
+
+
+def _backoff(attempt: int) -> float:
+    # full jitter so throttled syncs of many users don't retry in lockstep
+    return random.uniform(0, min(settings.provider_backoff_cap_seconds, settings.provider_backoff_base_seconds * 2 ** attempt))
+
+
+def _retry_after(response: requests.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
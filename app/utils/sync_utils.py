@@ -0,0 +1,246 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import delete, update, select, func, literal_column
+from sqlalchemy.dialects.postgresql import insert
+from datetime import datetime, timedelta, timezone
+
+from app import models
+from app.utils import task_changes, task_events
+
+
+UPSERT_BATCH_SIZE = 500
+
+# re-read a small window before the cursor so clock skew between us and the provider never drops a change
+SYNC_CURSOR_OVERLAP = timedelta(minutes=5)
+
+# columns refreshed from the provider when an existing task changes
+UPSERT_UPDATE_COLUMNS = ("title", "description", "deadline", "status", "category", "priority", "source", "updated_at", "change_seq")
+
+
+def parse_provider_datetime(value) -> datetime | None:
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def format_rfc3339(value: datetime) -> str:
+    return value.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def get_sync_cursor(integration: models.Integration, full_sync: bool = False) -> datetime | None:
+    """
+    Return the point in time the provider should be asked for changes since, or None for a full sync.
+    """
+    if full_sync or not integration.sync_cursor:
+        return None
+
+    cursor = parse_provider_datetime(integration.sync_cursor)
+    return cursor - SYNC_CURSOR_OVERLAP if cursor else None
+
+
+def advance_sync_cursor(integration: models.Integration, started_at: datetime):
+    """
+    Move the cursor to the start of a sync; persisted by the same commit that writes the synced tasks.
+    """
+    integration.sync_cursor = format_rfc3339(started_at)
+    integration.last_synced_at = started_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def load_existing_tasks(db: Session, user_id: int, source: str, provider_ids=None) -> dict[str, tuple]:
+    """
+    Load the user's `integration_provider_task_id -> (updated_at, title, deadline, status)` map for one source
+    (or only for `provider_ids`) in a single query.
+    """
+    query = db.query(models.Task.integration_provider_task_id, models.Task.updated_at, models.Task.title, models.Task.deadline, models.Task.status).filter(
+        models.Task.user_id == user_id,
+        models.Task.source == source,
+        models.Task.integration_provider_task_id.isnot(None),
+    )
+    if provider_ids is not None:
+        query = query.filter(models.Task.integration_provider_task_id.in_(list(provider_ids)))
+    rows = query.all()
+
+    return {provider_id: tuple(fields) for provider_id, *fields in rows}
+
+
+class TaskUpserter:
+    """
+    Shared upsert stage for provider syncs.
+    Changed rows are buffered and written with INSERT ... ON CONFLICT (user_id, integration_provider_task_id) DO UPDATE
+    statements; rows that did not change since the last sync are skipped (by the provider's `updated_at` and status,
+    or by title, deadline and status for providers that don't report one). Tasks the provider reports as deleted
+    are removed with `remove()` and logged as change feed tombstones.
+    Every `flush()` (a full batch, or one provider page) and the final `commit()` is its own short transaction:
+    the user's change sequence (which locks the user row) is taken right before the writes and released by their
+    commit, never held while the provider is called.
+    With `preload=False` the stored rows are not loaded up front: the caller `prefetch()`es the ids of each page
+    and they are dropped again on flush, so memory stays bounded to one page however long the history is.
+    """
+
+    def __init__(self, db: Session, user_id: int, source: str, batch_size: int = UPSERT_BATCH_SIZE, preload: bool = True):
+        self.db = db
+        self.user_id = user_id
+        self.source = source
+        self.batch_size = batch_size
+        self.preload = preload
+        self.existing = load_existing_tasks(db, user_id, source) if preload else {}
+        self.pending: dict[str, dict] = {}
+        self.removed: set[str] = set()
+        self.expire_overdue_tasks = False
+        self.change_seq = None
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.deleted = 0
+
+
+    def add(self, task_data: dict):
+        provider_id = task_data["integration_provider_task_id"]
+        updated_at = parse_provider_datetime(task_data.get("updated_at"))
+
+        if provider_id in self.existing and self._is_unchanged(self.existing[provider_id], task_data, updated_at):
+            self.skipped += 1
+            return
+
+        if updated_at is None:
+            updated_at = datetime.now(timezone.utc)
+
+        self.removed.discard(provider_id)
+        self.existing[provider_id] = (updated_at, task_data["title"], parse_provider_datetime(task_data.get("deadline")), task_data["status"])
+        # keyed by provider id so one statement never touches the same row twice
+        self.pending[provider_id] = {**task_data, "updated_at": updated_at, "source": self.source, "user_id": self.user_id}
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+
+    def remove(self, provider_id: str):
+        self.pending.pop(provider_id, None)
+        if self.existing.pop(provider_id, None) is None:
+            return
+
+        self.removed.add(provider_id)
+        if len(self.removed) >= self.batch_size:
+            self.flush()
+
+
+    def prefetch(self, provider_ids):
+        # stored state of the next page's rows, for upserters created with preload=False
+        self.existing.update(load_existing_tasks(self.db, self.user_id, self.source, provider_ids))
+
+
+    def expire_overdue(self):
+        """
+        Also flip stored in-progress tasks whose deadline has passed to Overdue on commit. Syncs that skip
+        inactive items by cursor never re-read them, so a due date passing without activity is caught here.
+        """
+        self.expire_overdue_tasks = True
+
+
+    @staticmethod
+    def _is_unchanged(existing: tuple, task_data: dict, updated_at: datetime | None) -> bool:
+        existing_updated_at, existing_title, existing_deadline, existing_status = existing
+
+        if updated_at is not None:
+            # status can move without provider activity (Trello cards turning Overdue), so it is compared as well
+            return existing_updated_at == updated_at and existing_status == task_data["status"]
+
+        return (existing_title, existing_deadline, existing_status) == (task_data["title"], parse_provider_datetime(task_data.get("deadline")), task_data["status"])
+
+
+    def _next_change_seq(self) -> int:
+        if self.change_seq is None:
+            # one sequence number for the whole sync
+            self.change_seq = task_changes.next_change_seq(self.db, self.user_id)
+        return self.change_seq
+
+
+    def _write_removed(self):
+        removed = list(self.removed)
+        for start in range(0, len(removed), self.batch_size):
+            deleted = self.db.execute(delete(models.Task).where(
+                models.Task.user_id == self.user_id,
+                models.Task.integration_provider_task_id.in_(removed[start:start + self.batch_size]),
+            ).returning(models.Task.id, models.Task.integration_provider_task_id)).all()
+            task_changes.record_deletions(self.db, self.user_id, self.change_seq, deleted)
+            task_events.queue_event(self.db, self.user_id, self.change_seq, "delete", [task_id for task_id, _ in deleted])
+            self.deleted += len(deleted)
+        self.removed = set()
+
+
+    def _write_pending(self):
+        rows = list(self.pending.values())
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            stmt = insert(models.Task).values([{**row, "change_seq": self.change_seq} for row in batch])
+            # provider ids are only unique per user: one Classroom coursework or Zoom meeting is a task of every user it belongs to
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[models.Task.user_id, models.Task.integration_provider_task_id],
+                set_={column: stmt.excluded[column] for column in UPSERT_UPDATE_COLUMNS},
+            )
+            # xmax is 0 only on freshly inserted rows, which tells inserts from updates for the push events and the counts
+            written = self.db.execute(stmt.returning(models.Task.id, literal_column("xmax = 0"))).all()
+            inserted_ids = [task_id for task_id, inserted in written if inserted]
+            updated_ids = [task_id for task_id, inserted in written if not inserted]
+            task_events.queue_event(self.db, self.user_id, self.change_seq, "insert", inserted_ids)
+            task_events.queue_event(self.db, self.user_id, self.change_seq, "update", updated_ids)
+            self.inserted += len(inserted_ids)
+            self.updated += len(updated_ids)
+            if len(written) < len(batch):
+                print(f"{self.source} sync for user {self.user_id}: {len(batch) - len(written)} rows not written")
+        self.pending = {}
+
+
+    def _write_overdue(self):
+        overdue_ids = self.db.scalars(select(models.Task.id).where(
+            models.Task.user_id == self.user_id,
+            models.Task.source == self.source,
+            models.Task.status == models.TaskStatus.IN_PROGRESS,
+            models.Task.deadline < func.now(),
+        )).all()
+        if not overdue_ids:
+            return
+
+        expired = self.db.execute(update(models.Task).where(
+            models.Task.id.in_(overdue_ids),
+            models.Task.status == models.TaskStatus.IN_PROGRESS,
+        ).values(
+            status=models.TaskStatus.OVERDUE,
+            change_seq=self._next_change_seq(),
+        ).returning(models.Task.id)).scalars().all()
+
+        task_events.queue_event(self.db, self.user_id, self.change_seq, "update", expired)
+        self.updated += len(expired)
+
+
+    def _write(self):
+        if self.pending or self.removed:
+            self._next_change_seq()
+            self._write_removed()
+            self._write_pending()
+
+
+    def flush(self):
+        """
+        Write and commit what is buffered, in its own transaction with its own change sequence.
+        """
+        if not self.pending and not self.removed:
+            return
+
+        self._write()
+        self.db.commit()
+        self.change_seq = None
+        if not self.preload:
+            self.existing = {}
+
+
+    def commit(self) -> dict[str, int]:
+        self._write()
+        if self.expire_overdue_tasks:
+            self._write_overdue()
+        self.db.commit()
+        self.change_seq = None
+
+        return {"inserted": self.inserted, "updated": self.updated, "skipped": self.skipped, "deleted": self.deleted}
@@ -0,0 +1,117 @@
+from fastapi import HTTPException, status
+from sqlalchemy import update, select, insert, delete, union_all, tuple_, literal
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+import base64, hashlib, json
+
+from app import models
+from app.config import settings
+
+
+def next_change_seq(db: Session, user_id: int) -> int:
+    """
+    Bump the user's task version; call once in every transaction that writes the user's tasks, before the writes,
+    and stamp the returned value on every written row. The user row stays locked until commit,
+    so the sequence numbers of one user commit in order and the change feed never skips one.
+    """
+    return db.execute(
+        update(models.User).where(models.User.id == user_id).values(tasks_version=models.User.tasks_version + 1).returning(models.User.tasks_version)
+    ).scalar_one()
+
+
+def next_change_seq_cte(user_id: int):
+    """
+    `next_change_seq` as a CTE for single-statement writes. Match the task rows with
+    `user_id == select(cte.c.id).scalar_subquery()` so the user row is still locked before any task row.
+    """
+    return update(models.User).where(models.User.id == user_id).values(tasks_version=models.User.tasks_version + 1).returning(
+        models.User.id, models.User.tasks_version).cte("next_change_seq")
+
+
+def get_tasks_version(db: Session, user_id: int) -> int:
+    return db.execute(select(models.User.tasks_version).where(models.User.id == user_id)).scalar_one_or_none() or 0
+
+
+def task_etag(user_id: int, version: int, variant: str = "") -> str:
+    # the variant (query string, task id) keeps different views of the same version apart
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:12]
+    return f'W/"{user_id}-{version}-{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    # weak comparison: W/ prefixes are ignored
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def record_deletions(db: Session, user_id: int, change_seq: int, deleted: list[tuple[int, str | None]]):
+    """
+    Write tombstones for `(task_id, integration_provider_task_id)` pairs deleted in the current transaction.
+    """
+    if deleted:
+        db.execute(insert(models.TaskTombstone), [
+            {"user_id": user_id, "task_id": task_id, "integration_provider_task_id": provider_id, "change_seq": change_seq}
+            for task_id, provider_id in deleted
+        ])
+
+
+def get_changes(db: Session, user_id: int, since: str | None, limit: int) -> dict:
+    """
+    Tasks written and deleted after the `since` cursor, in (change_seq, task id) order.
+    Live tasks and tombstones are walked as one keyset so a page never splits or repeats a change.
+    """
+    change_seq, task_id = decode_change_cursor(since) if since else (0, 0)
+    position = tuple_(change_seq, task_id)
+
+    live = select(models.Task.id.label("id"), models.Task.change_seq.label("change_seq"), literal(False).label("deleted")).where(
+        models.Task.user_id == user_id, tuple_(models.Task.change_seq, models.Task.id) > position)
+    dead = select(models.TaskTombstone.task_id, models.TaskTombstone.change_seq, literal(True)).where(
+        models.TaskTombstone.user_id == user_id, tuple_(models.TaskTombstone.change_seq, models.TaskTombstone.task_id) > position)
+
+    feed = union_all(live, dead).subquery()
+    rows = db.execute(select(feed).order_by(feed.c.change_seq, feed.c.id).limit(limit + 1)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    live_ids = [row.id for row in rows if not row.deleted]
+    dead_ids = [row.id for row in rows if row.deleted]
+
+    changed = db.query(models.Task).filter(models.Task.id.in_(live_ids)).order_by(models.Task.change_seq, models.Task.id).all() if live_ids else []
+    deleted = db.query(models.TaskTombstone).filter(models.TaskTombstone.user_id == user_id, models.TaskTombstone.task_id.in_(dead_ids)).order_by(models.TaskTombstone.change_seq, models.TaskTombstone.task_id).all() if dead_ids else []
+
+    if rows:
+        change_seq, task_id = rows[-1].change_seq, rows[-1].id
+
+    return {"changed": changed, "deleted": deleted, "cursor": encode_change_cursor(change_seq, task_id), "has_more": has_more}
+
+
+def encode_change_cursor(change_seq: int, task_id: int) -> str:
+    # issued time is kept so cursors older than the tombstone retention are refused instead of silently missing deletions
+    issued_at = int(datetime.now(timezone.utc).timestamp())
+    return base64.urlsafe_b64encode(json.dumps([change_seq, task_id, issued_at]).encode()).decode()
+
+
+def decode_change_cursor(cursor: str) -> tuple[int, int]:
+    try:
+        change_seq, task_id, issued_at = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        change_seq, task_id, issued_at = int(change_seq), int(task_id), int(issued_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+
+    if datetime.now(timezone.utc) - datetime.fromtimestamp(issued_at, timezone.utc) > timedelta(days=settings.task_tombstone_retention_days):
+        raise HTTPException(status.HTTP_410_GONE, "Cursor expired, reload the task list")
+
+    return change_seq, task_id
+
+
+def sweep_tombstones(db: Session) -> int:
+    expired_before = datetime.now(timezone.utc) - timedelta(days=settings.task_tombstone_retention_days)
+    result = db.execute(delete(models.TaskTombstone).where(models.TaskTombstone.deleted_at < expired_before))
+    db.commit()
+    return result.rowcount
@@ -0,0 +1,133 @@
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+import asyncio, json, select, threading
+
+from app.config import settings
+from app.database import engine
+
+
+CHANNEL = "task_events"
+
+# ids are left out of bigger events (Postgres NOTIFY payloads are capped at 8000 bytes), clients read the change feed instead
+MAX_EVENT_IDS = 100
+
+
+class LocalBroker:
+    """
+    In-process fan-out of task events to the push connections of this worker.
+    `publish` may be called from any thread, subscribers are asyncio queues of the event loop serving them.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.subscribers: dict[int, set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self.lock = threading.Lock()
+
+
+    def start(self):
+        pass
+
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.queue_size))
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber[1]
+
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        with self.lock:
+            subscribers = self.subscribers.get(user_id, set())
+            subscribers.difference_update({subscriber for subscriber in subscribers if subscriber[1] is queue})
+            if not subscribers:
+                self.subscribers.pop(user_id, None)
+
+
+    def publish(self, user_id: int, task_event: dict):
+        self.deliver(user_id, task_event)
+
+
+    def deliver(self, user_id: int, task_event: dict):
+        with self.lock:
+            subscribers = list(self.subscribers.get(user_id, ()))
+
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(_put, queue, task_event)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Fan-out across workers: events go through `NOTIFY task_events` and every worker delivers
+    what it hears on its own LISTEN connection to its local subscribers.
+    """
+
+    def start(self):
+        if getattr(self, "listener", None):
+            return
+        self.listener = threading.Thread(target=self._listen, name="task-events-listener", daemon=True)
+        self.listener.start()
+
+
+    def publish(self, user_id: int, task_event: dict):
+        with engine.begin() as connection:
+            connection.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": json.dumps({"user_id": user_id, **task_event})})
+
+
+    def _listen(self):
+        while True:
+            connection = engine.raw_connection()
+            try:
+                connection.driver_connection.autocommit = True
+                cursor = connection.cursor()
+                cursor.execute(f"LISTEN {CHANNEL}")
+
+                while True:
+                    if select.select([connection.driver_connection], [], [], 30) == ([], [], []):
+                        continue
+                    connection.driver_connection.poll()
+                    while connection.driver_connection.notifies:
+                        notify = connection.driver_connection.notifies.pop(0)
+                        task_event = json.loads(notify.payload)
+                        self.deliver(task_event.pop("user_id"), task_event)
+            except Exception as e:
+                print(f"Task events listener reconnecting: {e}")
+            finally:
+                connection.invalidate()
+
+
+def _put(queue: asyncio.Queue, task_event: dict):
+    try:
+        queue.put_nowait(task_event)
+    except asyncio.QueueFull:
+        # slow client: it falls back to the change feed on the next event it receives
+        pass
+
+
+broker = PostgresBroker() if settings.task_events_backend == "postgres" else LocalBroker()
+
+
+def queue_event(db: Session, user_id: int, change_seq: int, event_type: str, task_ids: list[int]):
+    """
+    Queue an `insert`/`update`/`delete` event on the session, it is published only once the transaction commits.
+    """
+    if task_ids:
+        db.info.setdefault("task_events", []).append((user_id, {
+            "type": event_type,
+            "change_seq": change_seq,
+            "task_ids": list(task_ids) if len(task_ids) <= MAX_EVENT_IDS else None,
+            "count": len(task_ids),
+        }))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed_events(session: Session):
+    for user_id, task_event in session.info.pop("task_events", []):
+        try:
+            broker.publish(user_id, task_event)
+        except Exception as e:
+            print(f"Failed to publish task event for user {user_id}: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rolled_back_events(session: Session):
+    session.info.pop("task_events", None)
@@ -0,0 +1,178 @@
+from fastapi import HTTPException, status
+from sqlalchemy import or_, and_, tuple_, func, cast, REAL
+from sqlalchemy.orm import Query, Session
+from cachetools import TTLCache
+from datetime import datetime
+import base64, csv, enum, io, json, threading
+
+from app import models, schemas
+from app.config import settings
+from app.utils import task_changes
+
+
+def filter_tasks(query: Query, user_id: int, filters: schemas.TaskFilter) -> Query:
+    query = query.filter(models.Task.user_id == user_id)
+
+    for column in ("status", "source", "category", "priority"):
+        value = getattr(filters, column)
+        if value is not None:
+            query = query.filter(getattr(models.Task, column) == value)
+
+    if filters.deadline_from is not None:
+        query = query.filter(models.Task.deadline >= filters.deadline_from)
+    if filters.deadline_to is not None:
+        query = query.filter(models.Task.deadline < filters.deadline_to)
+
+    return query
+
+
+EXPORT_COLUMNS = ("id", "title", "description", "category", "status", "priority", "deadline", "source", "added_at", "updated_at")
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def export_rows(query: Query):
+    """
+    Stream the tasks of `query` as plain rows through a server-side cursor, EXPORT_BATCH_SIZE at a time,
+    so no ORM object and no full result list is ever built.
+    """
+    columns = [getattr(models.Task, column) for column in EXPORT_COLUMNS]
+    # a legacy Query has no partitions(), its Core statement is executed on the query's session instead
+    stmt = query.with_entities(*columns).order_by(models.Task.id).statement
+    result = query.session.execute(stmt, execution_options={"stream_results": True, "yield_per": EXPORT_BATCH_SIZE})
+
+    for partition in result.partitions():
+        yield partition
+
+
+def to_ndjson(partition) -> str:
+    return "".join(json.dumps({column: _export_value(value) for column, value in zip(EXPORT_COLUMNS, row)}) + "\n" for row in partition)
+
+
+def to_csv(partition, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([_export_value(value) for value in row] for row in partition)
+    return buffer.getvalue()
+
+
+def _export_value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def search_tasks(query: Query, q: str, cursor: str | None = None) -> tuple[Query, object]:
+    """
+    Narrow `query` to tasks matching the web-search style `q` ("exam -draft", "\"final project\"") through the GIN index,
+    best ranked first; paginated by (rank, id) keyset so later pages don't rescan what earlier ones returned.
+    Returns the query and its rank expression.
+    """
+    ts_query = func.websearch_to_tsquery(models.TASK_SEARCH_CONFIG, q)
+    # ts_rank returns real: the cursor's rank is compared as real too, or the float4 -> float8 round trip never matches it
+    rank = func.ts_rank(models.Task.search_vector, ts_query, type_=REAL)
+
+    query = query.filter(models.Task.search_vector.op("@@")(ts_query))
+    if cursor:
+        last_rank, task_id = decode_search_cursor(cursor)
+        last_rank = cast(last_rank, REAL)
+        query = query.filter(or_(rank < last_rank, and_(rank == last_rank, models.Task.id < task_id)))
+
+    return query.order_by(rank.desc(), models.Task.id.desc()), rank
+
+
+def encode_search_cursor(rank: float, task_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, task_id]).encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        rank, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(task_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+
+
+STATS_DIMENSIONS = ("status", "priority", "category", "source")
+
+# user_id -> (tasks_version, stats); any write of the user's tasks bumps the version, which invalidates the entry
+stats_cache = TTLCache(maxsize=settings.task_stats_cache_size, ttl=settings.task_stats_cache_ttl_seconds)
+_stats_cache_lock = threading.Lock()
+
+
+def get_task_stats(db: Session, user_id: int) -> dict:
+    version = task_changes.get_tasks_version(db, user_id)
+
+    with _stats_cache_lock:
+        cached = stats_cache.get(user_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    stats = _compute_task_stats(db, user_id)
+    with _stats_cache_lock:
+        stats_cache[user_id] = (version, stats)
+    return stats
+
+
+def _compute_task_stats(db: Session, user_id: int) -> dict:
+    # one GROUP BY GROUPING SETS scan; the dimension columns are NOT NULL, so the only non-null one tells each row's set
+    columns = [getattr(models.Task, dimension) for dimension in STATS_DIMENSIONS]
+    overdue = func.count().filter(models.Task.deadline < func.now(), models.Task.status != models.TaskStatus.COMPLETED)
+
+    rows = db.query(*columns, func.count(), overdue).filter(models.Task.user_id == user_id).group_by(func.grouping_sets(*columns)).all()
+
+    stats = {"total": 0, "overdue": 0, **{f"by_{dimension}": {} for dimension in STATS_DIMENSIONS}}
+    for row in rows:
+        *values, count, overdue_count = row
+        for dimension, value in zip(STATS_DIMENSIONS, values):
+            if value is not None:
+                stats[f"by_{dimension}"][value.value] = count
+                if dimension == "status":
+                    stats["total"] += count
+                    stats["overdue"] += overdue_count
+
+    return stats
+
+
+def order_tasks(query: Query, descending: bool = False) -> Query:
+    # (deadline, id) ascending with NULL deadlines last, or the exact reverse, so both directions walk the same index
+    if descending:
+        return query.order_by(models.Task.deadline.desc().nulls_first(), models.Task.id.desc())
+    return query.order_by(models.Task.deadline.asc().nulls_last(), models.Task.id.asc())
+
+
+def after_cursor(query: Query, cursor: str, descending: bool = False) -> Query:
+    """
+    Keyset pagination: only rows after the (deadline, id) of the last row of the previous page,
+    so page N costs the same index range scan as page 1.
+    """
+    deadline, task_id = decode_cursor(cursor)
+    deadline_column, id_column = models.Task.deadline, models.Task.id
+
+    if not descending:
+        if deadline is None:
+            condition = and_(deadline_column.is_(None), id_column > task_id)
+        else:
+            condition = or_(tuple_(deadline_column, id_column) > tuple_(deadline, task_id), deadline_column.is_(None))
+    else:
+        if deadline is None:
+            condition = or_(and_(deadline_column.is_(None), id_column < task_id), deadline_column.isnot(None))
+        else:
+            condition = tuple_(deadline_column, id_column) < tuple_(deadline, task_id)
+
+    return query.filter(condition)
+
+
+def encode_cursor(task: models.Task) -> str:
+    deadline = task.deadline.isoformat() if task.deadline else None
+    return base64.urlsafe_b64encode(json.dumps([deadline, task.id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime | None, int]:
+    try:
+        deadline, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(deadline) if deadline else None), int(task_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
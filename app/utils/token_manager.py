@@ -0,0 +1,58 @@
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+import threading
+
+from app import models
+from app.config import settings
+from app.utils import crypt_utils
+
+
+# refresh this long before `Integration.expiry` so no provider call is made with a token about to expire
+REFRESH_MARGIN = timedelta(seconds=settings.token_refresh_margin_seconds)
+
+# service -> function(integration, db) that refreshes, persists and returns {"access_token": ...}
+refresh_backends = {}
+
+_locks: dict[int, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def register_refresh_backend(service: str, backend):
+    refresh_backends[service] = backend
+
+
+def get_access_token(integration: models.Integration, db: Session, rejected_token: str | None = None) -> str:
+    """
+    Return a usable decrypted access token for the integration, refreshing it shortly before it expires.
+    Pass `rejected_token` after a provider answered 401 to force a refresh.
+    Concurrent callers for the same integration share a single refresh and all get the new token.
+    """
+    if rejected_token is None and not _is_expiring(integration):
+        return crypt_utils.decrypt_credential(integration.id, integration.access_token)
+
+    with _lock_for(integration.id):
+        # another caller (thread, or process through the DB) may have refreshed while we waited
+        db.refresh(integration)
+        token = crypt_utils.decrypt_credential(integration.id, integration.access_token)
+        
+        if (rejected_token is None or token != rejected_token) and not _is_expiring(integration):
+            return token
+
+        backend = refresh_backends.get(integration.service)
+        if backend is None:
+            raise HTTPException(status.HTTP_401_UNAUTHORIZED, f"{integration.service} token was rejected. Please reconnect your account.")
+
+        backend(integration, db)
+        crypt_utils.invalidate_credentials(integration.id)
+        return crypt_utils.decrypt_credential(integration.id, integration.access_token)
+
+
+def _is_expiring(integration: models.Integration) -> bool:
+    # integrations without expiry (e.g. Trello `expiration=never`) never need a refresh
+    return integration.expiry is not None and integration.expiry - REFRESH_MARGIN <= datetime.utcnow()
+
+
+def _lock_for(integration_id: int) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(integration_id, threading.Lock())
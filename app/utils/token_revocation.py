@@ -0,0 +1,83 @@
+from sqlalchemy import select, delete, insert
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+import threading
+
+from app import models
+from app.config import settings
+
+
+# rows committed slightly out of created_at order are still picked up by the next refresh
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+class RevocationList:
+    """
+    In-memory copy of the non-expired `token_revocations` rows: revoked access token jtis and
+    per-user "issued before" epochs. The auth path only does dict lookups; `refresh` pulls the rows
+    created since the previous refresh, so every worker sees a revocation within one refresh interval.
+    """
+
+    def __init__(self):
+        self.jtis: dict[str, float] = {}        # jti -> token exp
+        self.epochs: dict[int, float] = {}      # user_id -> tokens issued before are invalid
+        self.loaded_until: datetime | None = None
+        self.lock = threading.Lock()
+
+
+    def is_revoked(self, jti: str | None, user_id: int, issued_at: int | None) -> bool:
+        if jti is not None and jti in self.jtis:
+            return True
+        epoch = self.epochs.get(user_id)
+        return epoch is not None and (issued_at or 0) < int(epoch)
+
+
+    def add(self, jti: str | None, user_id: int, not_before: datetime | None, expires_at: datetime):
+        with self.lock:
+            if jti is not None:
+                self.jtis[jti] = expires_at.timestamp()
+            if not_before is not None:
+                self.epochs[user_id] = max(self.epochs.get(user_id, 0), not_before.timestamp())
+
+
+    def refresh(self, db: Session):
+        now = datetime.now(timezone.utc)
+        query = select(models.TokenRevocation.jti, models.TokenRevocation.user_id, models.TokenRevocation.not_before, models.TokenRevocation.expires_at).where(
+            models.TokenRevocation.expires_at > now)
+        if self.loaded_until is not None:
+            query = query.where(models.TokenRevocation.created_at > self.loaded_until - REFRESH_OVERLAP)
+
+        for row in db.execute(query):
+            self.add(*row)
+
+        with self.lock:
+            self.loaded_until = now
+            # epochs only matter while tokens issued before them can still be unexpired
+            self.jtis = {jti: exp for jti, exp in self.jtis.items() if exp > now.timestamp()}
+            horizon = (now - timedelta(minutes=settings.access_token_expire_minutes)).timestamp()
+            self.epochs = {user_id: epoch for user_id, epoch in self.epochs.items() if epoch > horizon}
+
+
+revocation_list = RevocationList()
+
+
+def revoke_access_token(db: Session, jti: str, user_id: int, expires_at: datetime):
+    # caller commits, then calls `revocation_list.add` for the change to apply to this worker at once;
+    # revoking an already revoked token is a no-op
+    db.execute(postgresql.insert(models.TokenRevocation).values(jti=jti, user_id=user_id, expires_at=expires_at).on_conflict_do_nothing(index_elements=["jti"]))
+
+
+def revoke_user_access_tokens(db: Session, user_id: int, not_before: datetime):
+    # caller commits; also kept on the user (users.tokens_invalid_before) past the lifetime of the row
+    db.execute(insert(models.TokenRevocation).values(
+        user_id=user_id,
+        not_before=not_before,
+        expires_at=not_before + timedelta(minutes=settings.access_token_expire_minutes),
+    ))
+
+
+def sweep_revocations(db: Session) -> int:
+    result = db.execute(delete(models.TokenRevocation).where(models.TokenRevocation.expires_at < datetime.now(timezone.utc)))
+    db.commit()
+    return result.rowcount
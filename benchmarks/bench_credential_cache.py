@@ -0,0 +1,86 @@
+"""
+Microbenchmark of `crypt_utils.decrypt_credential` against plain Fernet `decrypt`
+under a scheduled-sync workload: each integration is synced once per sync interval plus jitter,
+as the background scheduler does, and every sync decrypts its access token (and a share of them
+also their refresh token). A simulated clock drives the cache TTL, so expiry between syncs is
+counted as it would be in production.
+
+Run from the project root with the app's .env available:
+    python -m benchmarks.bench_credential_cache
+"""
+import random
+import time
+
+from cachetools import TTLCache
+
+from app.config import settings
+from app.utils import crypt_utils
+
+
+INTEGRATIONS = 2000
+SYNCS_PER_INTEGRATION = 20
+REFRESH_SHARE = 0.1
+# every access token after its first sync is a hit; refresh tokens used more than two syncs apart expire in between
+EXPECTED_HIT_RATE = 0.85
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def schedule() -> list[tuple[float, int]]:
+    # (time, integration id) of every sync: first ones spread over one interval, then one interval plus jitter apart
+    random.seed(42)
+    interval = settings.sync_interval_minutes * 60
+    syncs = []
+    for integration_id in range(INTEGRATIONS):
+        at = random.uniform(0, interval)
+        for _ in range(SYNCS_PER_INTEGRATION):
+            syncs.append((at, integration_id))
+            at += interval + random.uniform(0, settings.sync_jitter_seconds)
+    return sorted(syncs)
+
+
+def run(decrypt_access, decrypt_refresh, integrations: dict[int, tuple[str, str]], syncs: list[tuple[float, int]], clock: SimulatedClock) -> float:
+    # same access pattern for every run
+    random.seed(42)
+    started = time.perf_counter()
+
+    for at, integration_id in syncs:
+        clock.now = at
+        access_token, refresh_token = integrations[integration_id]
+        decrypt_access(integration_id, access_token)
+        if random.random() < REFRESH_SHARE:
+            decrypt_refresh(integration_id, refresh_token)
+
+    return time.perf_counter() - started
+
+
+def main():
+    integrations = {
+        integration_id: (crypt_utils.encrypt(f"access-{integration_id}" * 8), crypt_utils.encrypt(f"refresh-{integration_id}" * 8))
+        for integration_id in range(INTEGRATIONS)
+    }
+    syncs = schedule()
+    clock = SimulatedClock()
+    crypt_utils.credential_cache = TTLCache(maxsize=settings.credential_cache_size, ttl=crypt_utils.credential_cache_ttl, timer=clock)
+
+    uncached = run(lambda _, token: crypt_utils.decrypt(token), lambda _, token: crypt_utils.decrypt(token), integrations, syncs, clock)
+    cached = run(crypt_utils.decrypt_credential, crypt_utils.decrypt_credential, integrations, syncs, clock)
+
+    stats = crypt_utils.credential_cache_stats
+    calls = stats["hits"] + stats["misses"]
+    print(f"{INTEGRATIONS} integrations x {SYNCS_PER_INTEGRATION} syncs, {settings.sync_interval_minutes} min interval, {crypt_utils.credential_cache_ttl} s TTL ({calls} decrypts)")
+    print(f"fernet decrypt : {uncached * 1000:8.1f} ms  ({uncached / calls * 1e6:6.2f} us/call)")
+    print(f"credential cache: {cached * 1000:8.1f} ms  ({cached / calls * 1e6:6.2f} us/call)")
+    print(f"speedup        : {uncached / cached:8.1f}x")
+    print(f"hit rate       : {stats['hits'] / calls:8.1%}")
+    assert stats["hits"] / calls >= EXPECTED_HIT_RATE, f"hit rate below {EXPECTED_HIT_RATE:.0%}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Login throughput of the bcrypt verification behind `POST /api/auth/login`, per cost factor:
+a burst of concurrent logins calls `crypt_utils.verify` from the request threadpool, as the sync route does.
+
+Run from the project root with the app's .env available:
+    python -m benchmarks.bench_password_hashing
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.hash import bcrypt
+
+from app.utils import crypt_utils
+
+
+LOGINS = 64
+ROUNDS = (10, 11, 12, 13)
+# FastAPI runs sync routes on the anyio threadpool, 40 threads by default
+REQUEST_THREADS = 40
+
+
+def burst(hashed: str) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=REQUEST_THREADS) as request_threads:
+        results = list(request_threads.map(lambda _: crypt_utils.verify("correct horse battery staple", hashed), range(LOGINS)))
+    assert all(results)
+    return time.perf_counter() - started
+
+
+def main():
+    cores = os.cpu_count() or 1
+    workers = crypt_utils.password_hash_pool._max_workers
+    print(f"{LOGINS} concurrent logins, {workers} hashing threads, {cores} cores")
+
+    for rounds in ROUNDS:
+        hashed = bcrypt.using(rounds=rounds).hash("correct horse battery staple")
+        elapsed = burst(hashed)
+        per_second = LOGINS / elapsed
+        print(f"cost {rounds}: {elapsed * 1000:8.1f} ms  {per_second:7.1f} logins/s  {per_second / min(workers, cores):6.1f} logins/s/core")
+
+
+if __name__ == "__main__":
+    main()